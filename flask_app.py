@@ -1,84 +1,306 @@
+import gzip
+import hashlib
 import os
+import orjson
+import queue
 import sqlite3
-from flask import Flask, jsonify, g, request
+import sys
+import threading
+import time
+import zlib
+from functools import wraps
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
+from markupsafe import escape
+from werkzeug.exceptions import HTTPException
 from datetime import datetime
 
 load_dotenv()
 
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify() backed by orjson instead of the stdlib json module"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 app.config['DATABASE'] = os.getenv('FLASK_DATABASE_PATH', './flask_database.sqlite')
 
+# Per-connection tuning, applied once when the pool opens a connection.
+# journal_mode=WAL is persistent in the database file and is set in init_db().
+# Connections run in autocommit mode; write paths open their own
+# BEGIN IMMEDIATE so they take the write lock up front instead of failing
+# to upgrade a read transaction when another writer got there first.
+# Reads go through the memory map, i.e. the OS page cache, which every pooled
+# connection and worker process shares. That makes it our shared cache, so
+# each connection's private page cache (mostly WAL and write pages) is kept
+# small rather than duplicating the same hot pages per connection.
+# SQLite's own cache=shared mode is not used: it falls back to table-level
+# locking and is discouraged alongside WAL.
+CONNECTION_PRAGMAS = '''
+    PRAGMA busy_timeout = 50;
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -8192;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA foreign_keys = ON;
+'''
+
+# Waiting for the write lock inside SQLite's busy handler is a C-level sleep,
+# which under gevent stalls every greenlet in the worker. Keep busy_timeout
+# short and do the long wait here with sleeps the event loop can schedule
+# around.
+WRITE_LOCK_TIMEOUT = 5  # seconds
+
+def begin_immediate(db):
+    deadline = time.monotonic() + WRITE_LOCK_TIMEOUT
+    delay = 0.001
+    while True:
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or time.monotonic() >= deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+class ConnectionPool:
+    """Bounded set of long-lived SQLite connections handed out per request.
+
+    Connections keep their page cache and prepared-statement cache between
+    requests. A request checks one out on first use and returns it at
+    teardown; when all are in use, the next request waits for one.
+    """
+
+    def __init__(self, path, size, timeout=10):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # A connection is only ever used by one request at a time, but not
+        # always on the thread that opened it
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        # Rows stay plain tuples: every query names its columns and is read
+        # by position, so building sqlite3.Row objects would be wasted work
+        conn.executescript(CONNECTION_PRAGMAS)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError('Timed out waiting for a database connection')
+
+    def release(self, conn):
+        # Never hand the next request a transaction (and its lock) left open
+        # by a failed one
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+connection_pool = None
+
+def get_pool():
+    """Get or create the connection pool"""
+    global connection_pool
+    if connection_pool is None:
+        connection_pool = ConnectionPool(
+            app.config['DATABASE'],
+            int(os.getenv('FLASK_DB_POOL_SIZE', 8))
+        )
+    return connection_pool
+
 def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(app.config['DATABASE'])
-        db.row_factory = sqlite3.Row
+    # Hot path: later calls in the same request are a single attribute read
+    try:
+        return g._database
+    except AttributeError:
+        pass
+    db = g._database = get_pool().acquire()
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+
+# Errors raised by any view end up here: API routes get the JSON error
+# envelope, the HTML database views get a plain error page
+@app.errorhandler(Exception)
+def handle_exception(e):
+    if request.path.startswith('/api/'):
+        code = e.code if isinstance(e, HTTPException) else 500
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), code
+    if isinstance(e, HTTPException):
+        return e
+    return f'<h1>Error</h1><p>{escape(str(e))}</p>', 500
+
+# Short-lived cache for the endpoints the player polls. Entries are dropped
+# as soon as this process writes a track or rating; the TTL bounds staleness
+# from writers outside the process (metadata poller, track rotator).
+CACHE_TTL = 5  # seconds
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Serve a successful JSON response from the cache until it expires. The
+# ETag is a hash of the body rather than a write counter: the poller and
+# track rotator update the database directly, so only the content itself
+# says whether a client's copy is still current. Clients and proxies may also
+# reuse a response for as long as it would be cached here.
+def cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_TTL
+    return response.make_conditional(request)
+
+def cached_json(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        now = time.monotonic()
+        entry = _cache.get(view.__name__)
+        if entry is not None and entry[0] > now:
+            return cache_headers(Response(entry[1], mimetype='application/json'), entry[2])
+
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            with _cache_lock:
+                _cache[view.__name__] = (now + CACHE_TTL, body, etag)
+            cache_headers(response, etag)
+        return response
+    return wrapper
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache.clear()
+
+# Stored in the database's user_version once init_db() has run, so worker
+# restarts skip the DDL and seed probe. Bump it whenever the schema changes.
+SCHEMA_VERSION = 2
 
 def init_db():
     with app.app_context():
         db = get_db()
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                email TEXT NOT NULL UNIQUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                user_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS tracks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                artist TEXT NOT NULL,
-                title TEXT NOT NULL,
-                album TEXT,
-                year INTEGER,
-                album_art_url TEXT,
-                played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_current BOOLEAN DEFAULT 0
-            )
-        ''')
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS ratings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                track_id INTEGER NOT NULL,
-                user_id TEXT NOT NULL,
-                rating_type INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (track_id) REFERENCES tracks (id),
-                UNIQUE (track_id, user_id)
-            )
-        ''')
-        db.commit()
-
-        # Seed with sample data
-        seed_sample_tracks(db)
+        if db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            return
+
+        # WAL lets the player's read endpoints run alongside track updates
+        db.execute('PRAGMA journal_mode = WAL')
+        # Schema, version stamp and seed data commit as one transaction
+        with db:
+            begin_immediate(db)
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL UNIQUE,
+                    email TEXT NOT NULL UNIQUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    user_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS tracks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    artist TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    album TEXT,
+                    year INTEGER,
+                    album_art_url TEXT,
+                    played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    is_current BOOLEAN DEFAULT 0,
+                    thumbs_up INTEGER NOT NULL DEFAULT 0,
+                    thumbs_down INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            # now-playing probes is_current = 1, recently-played reads
+            # is_current = 0 in played_at order; one index serves both
+            db.execute('CREATE INDEX IF NOT EXISTS idx_tracks_current_played ON tracks (is_current, played_at DESC)')
+            # One row per song; update-track upserts against this
+            db.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_tracks_artist_title ON tracks (artist, title)')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS ratings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    track_id INTEGER NOT NULL,
+                    user_id TEXT NOT NULL,
+                    rating_type INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (track_id) REFERENCES tracks (id),
+                    UNIQUE (track_id, user_id)
+                )
+            ''')
+
+            # Rating counters are kept on tracks so now-playing is a single
+            # row read; databases from before they existed get them backfilled.
+            # Nothing else aggregates ratings per track, so the one-time
+            # backfill goes through the UNIQUE (track_id, user_id) index
+            # rather than a (track_id, rating_type) index every insert pays for.
+            columns = {name for name, in db.execute("SELECT name FROM pragma_table_info('tracks')")}
+            if 'thumbs_up' not in columns:
+                db.execute('ALTER TABLE tracks ADD COLUMN thumbs_up INTEGER NOT NULL DEFAULT 0')
+                db.execute('ALTER TABLE tracks ADD COLUMN thumbs_down INTEGER NOT NULL DEFAULT 0')
+                db.execute('''
+                    UPDATE tracks SET
+                        thumbs_up = (SELECT COUNT(*) FROM ratings
+                                     WHERE track_id = tracks.id AND rating_type = 1),
+                        thumbs_down = (SELECT COUNT(*) FROM ratings
+                                       WHERE track_id = tracks.id AND rating_type = -1)
+                ''')
+            db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+            # Seed with sample data
+            seed_sample_tracks(db)
+
+        # Give the planner statistics for the new indexes
+        db.execute('ANALYZE')
 
         print(f'Database initialized at: {app.config["DATABASE"]}')
 
 def seed_sample_tracks(db):
-    # Check if tracks already exist
-    count = db.execute('SELECT COUNT(*) as count FROM tracks').fetchone()['count']
-    if count > 0:
+    # Check if tracks already exist (stops at the first row, unlike COUNT(*))
+    if db.execute('SELECT 1 FROM tracks LIMIT 1').fetchone() is not None:
         return
 
     # Sample tracks data
@@ -91,19 +313,30 @@ def seed_sample_tracks(db):
         ('Etta James', 'I\'d Rather Go Blind', 'Tell Mama', 1967, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Etta'),
     ]
 
-    # Insert tracks with the first one as current
-    for i, (artist, title, album, year, art_url) in enumerate(sample_tracks):
-        is_current = 1 if i == 0 else 0
-        db.execute('''
-            INSERT INTO tracks (artist, title, album, year, album_art_url, is_current)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (artist, title, album, year, art_url, is_current))
-
-    db.commit()
-
-@app.route('/')
-def home():
-    return '''
+    # Insert tracks with the first one as current. Runs inside init_db's
+    # BEGIN IMMEDIATE, so the rows commit together with the schema.
+    db.executemany('''
+        INSERT INTO tracks (artist, title, album, year, album_art_url, is_current)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [track + (1 if i == 0 else 0,) for i, track in enumerate(sample_tracks)])
+
+# Zip the cursor's column names with a row's values
+def row_dict(cursor, row):
+    return dict(zip([column[0] for column in cursor.description], row))
+
+# The rating and update endpoints build their small payloads straight into
+# orjson bytes, skipping jsonify's provider lookup and str round trip
+def json_response(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+# Wrap a query that returns a single JSON array (built in SQLite with
+# json_group_array) in the success envelope, skipping Row -> dict -> json
+def json_data_response(query, params=()):
+    data = get_db().execute(query, params).fetchone()[0]
+    return Response('{"status":"success","data":' + data + '}', mimetype='application/json')
+
+# Static pages and page skeletons, built once at import
+HOME_HTML = b'''
     <!DOCTYPE html>
     <html>
     <head>
@@ -150,474 +383,370 @@ def home():
         </div>
     </body>
     </html>
-    '''
+'''
+
+HOME_HTML_GZ = gzip.compress(HOME_HTML, 9)
+
+# Served by now-playing whenever no track is marked current
+FALLBACK_NOW_PLAYING = orjson.dumps({
+    'status': 'success',
+    'data': {
+        'id': None,
+        'artist': 'Radio Calico',
+        'title': '24-bit Lossless Streaming',
+        'album': 'Crystal-Clear Audio',
+        'year': None,
+        'album_art_url': 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Radio+Calico',
+        'played_at': None,
+        'thumbs_up': 0,
+        'thumbs_down': 0
+    }
+})
+
+# SQL for the hot API routes. sqlite3 keeps a per-connection cache of
+# prepared statements keyed on the exact SQL text, and pooled connections
+# live across requests, so stable strings are parsed and planned once per
+# connection rather than on every call.
+SQL_NOW_PLAYING = '''
+    SELECT json_object(
+        'id', id, 'artist', artist, 'title', title, 'album', album,
+        'year', year, 'album_art_url', album_art_url, 'played_at', played_at,
+        'thumbs_up', thumbs_up, 'thumbs_down', thumbs_down
+    )
+    FROM tracks
+    WHERE is_current = 1
+    LIMIT 1
+'''
+
+SQL_USER_RATING = '''
+    SELECT rating_type FROM ratings
+    WHERE track_id = ? AND user_id = ?
+'''
+
+# Returns no row when the user has already rated the track
+SQL_INSERT_RATING = '''
+    INSERT INTO ratings (track_id, user_id, rating_type)
+    VALUES (?, ?, ?)
+    ON CONFLICT (track_id, user_id) DO NOTHING
+    RETURNING id
+'''
+
+SQL_BUMP_TRACK_COUNTS = '''
+    UPDATE tracks
+    SET thumbs_up = thumbs_up + ?, thumbs_down = thumbs_down + ?
+    WHERE id = ?
+    RETURNING thumbs_up, thumbs_down
+'''
+
+SQL_CLEAR_CURRENT = 'UPDATE tracks SET is_current = 0 WHERE is_current = 1'
+
+SQL_UPSERT_CURRENT = '''
+    INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
+    VALUES (?, ?, ?, ?, 1, ?)
+    ON CONFLICT (artist, title) DO UPDATE
+    SET is_current = 1, played_at = CURRENT_TIMESTAMP
+'''
+
+# The HTML pages are mostly repeated markup and compress very well. nginx
+# only proxies /api/, so these pages are compressed here rather than there.
+def accepts_gzip():
+    return 'gzip' in request.accept_encodings
+
+def gzip_response(body):
+    response = Response(body, mimetype='text/html')
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# gzip a stream of HTML chunks without buffering the whole page
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Jinja emits a chunk for every piece of markup and every expression, which
+# is around fifteen per table row. Buffer them into larger writes before
+# they reach the socket or the compressor.
+TEMPLATE_BUFFER_EVENTS = 256
+
+def stream_page(template, **context):
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template).stream(context)
+    stream.enable_buffering(TEMPLATE_BUFFER_EVENTS)
+    chunks = stream_with_context(stream)
+    if accepts_gzip():
+        return gzip_response(gzip_stream(chunks))
+    return Response(chunks, mimetype='text/html')
+
+@app.route('/')
+def home():
+    # Prebuilt bytes are handed to the WSGI server as they are
+    if accepts_gzip():
+        response = gzip_response(HOME_HTML_GZ)
+    else:
+        response = Response(HOME_HTML, mimetype='text/html')
+        response.vary.add('Accept-Encoding')
+    response.direct_passthrough = True
+    return response
 
 @app.route('/api/test')
 def test_db():
-    try:
-        db = get_db()
-        cursor = db.execute('SELECT 1 as test')
-        result = dict(cursor.fetchone())
-        return jsonify({
-            'status': 'success',
-            'message': 'Database connection working',
-            'result': result
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    db = get_db()
+    cursor = db.execute('SELECT 1 as test')
+    result = row_dict(cursor, cursor.fetchone())
+    return jsonify({
+        'status': 'success',
+        'message': 'Database connection working',
+        'result': result
+    })
 
 @app.route('/api/users')
 def get_users():
-    try:
-        db = get_db()
-        cursor = db.execute('SELECT * FROM users')
-        users = [dict(row) for row in cursor.fetchall()]
-        return jsonify({
-            'status': 'success',
-            'data': users
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return json_data_response('''
+        SELECT json_group_array(json_object(
+            'id', id, 'username', username, 'email', email,
+            'created_at', created_at
+        ))
+        FROM users
+    ''')
 
 @app.route('/api/posts')
 def get_posts():
-    try:
-        db = get_db()
-        cursor = db.execute('SELECT * FROM posts')
-        posts = [dict(row) for row in cursor.fetchall()]
-        return jsonify({
-            'status': 'success',
-            'data': posts
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return json_data_response('''
+        SELECT json_group_array(json_object(
+            'id', id, 'title', title, 'content', content,
+            'user_id', user_id, 'created_at', created_at
+        ))
+        FROM posts
+    ''')
 
 @app.route('/api/now-playing')
+@cached_json
 def now_playing():
-    try:
-        db = get_db()
-        cursor = db.execute('''
-            SELECT id, artist, title, album, year, album_art_url
-            FROM tracks
-            WHERE is_current = 1
-            LIMIT 1
-        ''')
-        track = cursor.fetchone()
-
-        if track:
-            track_dict = dict(track)
-            # Get ratings for this track
-            ratings_cursor = db.execute('''
-                SELECT
-                    SUM(CASE WHEN rating_type = 1 THEN 1 ELSE 0 END) as thumbs_up,
-                    SUM(CASE WHEN rating_type = -1 THEN 1 ELSE 0 END) as thumbs_down
-                FROM ratings
-                WHERE track_id = ?
-            ''', (track_dict['id'],))
-            ratings = ratings_cursor.fetchone()
-            track_dict['thumbs_up'] = ratings['thumbs_up'] or 0
-            track_dict['thumbs_down'] = ratings['thumbs_down'] or 0
-
-            return jsonify({
-                'status': 'success',
-                'data': track_dict
-            })
-        else:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'id': None,
-                    'artist': 'Radio Calico',
-                    'title': '24-bit Lossless Streaming',
-                    'album': 'Crystal-Clear Audio',
-                    'year': None,
-                    'album_art_url': 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Radio+Calico',
-                    'thumbs_up': 0,
-                    'thumbs_down': 0
-                }
-            })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    db = get_db()
+    # SQLite serializes the row itself; only the envelope is added here
+    track = db.execute(SQL_NOW_PLAYING).fetchone()
+
+    if track:
+        return Response('{"status":"success","data":' + track[0] + '}',
+                        mimetype='application/json')
+    else:
+        return Response(FALLBACK_NOW_PLAYING, mimetype='application/json')
 
 @app.route('/api/recently-played')
+@cached_json
 def recently_played():
-    try:
-        db = get_db()
-        cursor = db.execute('''
+    return json_data_response('''
+        SELECT json_group_array(json_object(
+            'artist', artist, 'title', title, 'album', album,
+            'year', year, 'played_at', played_at
+        ))
+        FROM (
             SELECT artist, title, album, year, played_at
             FROM tracks
             WHERE is_current = 0
             ORDER BY played_at DESC
             LIMIT 5
-        ''')
-        tracks = [dict(row) for row in cursor.fetchall()]
-
-        return jsonify({
-            'status': 'success',
-            'data': tracks
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+        )
+    ''')
 
 @app.route('/api/tracks/<int:track_id>/rate', methods=['POST'])
 def rate_track(track_id):
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        rating_type = data.get('rating_type')  # 1 for thumbs up, -1 for thumbs down
-
-        if not user_id:
-            return jsonify({
-                'status': 'error',
-                'message': 'user_id is required'
-            }), 400
-
-        if rating_type not in [1, -1]:
-            return jsonify({
-                'status': 'error',
-                'message': 'rating_type must be 1 (thumbs up) or -1 (thumbs down)'
-            }), 400
-
-        db = get_db()
-
-        # Check if track exists
-        track = db.execute('SELECT id FROM tracks WHERE id = ?', (track_id,)).fetchone()
-        if not track:
-            return jsonify({
-                'status': 'error',
-                'message': 'Track not found'
-            }), 404
-
-        # Check if user has already rated this track
-        existing_rating = db.execute('''
-            SELECT rating_type FROM ratings
-            WHERE track_id = ? AND user_id = ?
-        ''', (track_id, user_id)).fetchone()
-
-        if existing_rating:
-            return jsonify({
-                'status': 'error',
-                'message': 'You have already rated this track',
-                'existing_rating': existing_rating['rating_type']
-            }), 409
-
-        # Insert the rating
-        db.execute('''
-            INSERT INTO ratings (track_id, user_id, rating_type)
-            VALUES (?, ?, ?)
-        ''', (track_id, user_id, rating_type))
-        db.commit()
-
-        # Get updated rating counts
-        ratings_cursor = db.execute('''
-            SELECT
-                SUM(CASE WHEN rating_type = 1 THEN 1 ELSE 0 END) as thumbs_up,
-                SUM(CASE WHEN rating_type = -1 THEN 1 ELSE 0 END) as thumbs_down
-            FROM ratings
-            WHERE track_id = ?
-        ''', (track_id,))
-        ratings = ratings_cursor.fetchone()
+    data = request.get_json()
+    user_id = data.get('user_id')
+    rating_type = data.get('rating_type')  # 1 for thumbs up, -1 for thumbs down
 
-        return jsonify({
-            'status': 'success',
-            'message': 'Rating submitted successfully',
-            'data': {
-                'thumbs_up': ratings['thumbs_up'] or 0,
-                'thumbs_down': ratings['thumbs_down'] or 0
-            }
-        })
-    except Exception as e:
-        return jsonify({
+    if not user_id:
+        return json_response({
             'status': 'error',
-            'message': str(e)
-        }), 500
-
-@app.route('/api/tracks/<int:track_id>/rating-status', methods=['POST'])
-def get_rating_status(track_id):
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-
-        if not user_id:
-            return jsonify({
-                'status': 'error',
-                'message': 'user_id is required'
-            }), 400
+            'message': 'user_id is required'
+        }, 400)
 
-        db = get_db()
-
-        # Check if user has rated this track
-        existing_rating = db.execute('''
-            SELECT rating_type FROM ratings
-            WHERE track_id = ? AND user_id = ?
-        ''', (track_id, user_id)).fetchone()
-
-        if existing_rating:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'has_rated': True,
-                    'rating_type': existing_rating['rating_type']
-                }
-            })
-        else:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'has_rated': False,
-                    'rating_type': None
-                }
-            })
-    except Exception as e:
-        return jsonify({
+    if rating_type not in [1, -1]:
+        return json_response({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': 'rating_type must be 1 (thumbs up) or -1 (thumbs down)'
+        }, 400)
 
-@app.route('/api/update-track', methods=['POST'])
-def update_track():
+    db = get_db()
+
+    # Insert the rating and bump the track's counter in the same transaction.
+    # The unique (track_id, user_id) constraint detects a repeat rating, and
+    # the foreign key on track_id (foreign_keys is on for every pooled
+    # connection) rejects an unknown track.
     try:
-        data = request.get_json()
-        artist = data.get('artist', 'Unknown Artist')
-        title = data.get('title', 'Unknown Track')
-        album = data.get('album', 'Live Stream')
-        year = data.get('year')
+        with db:
+            begin_immediate(db)
+            inserted = db.execute(SQL_INSERT_RATING, (track_id, user_id, rating_type)).fetchone()
+            if inserted is None:
+                existing_rating = db.execute(SQL_USER_RATING, (track_id, user_id)).fetchone()
+            else:
+                ratings = db.execute(
+                    SQL_BUMP_TRACK_COUNTS,
+                    (int(rating_type == 1), int(rating_type == -1), track_id)
+                ).fetchone()
+    except sqlite3.IntegrityError as e:
+        if 'FOREIGN KEY' not in str(e):
+            raise
+        return json_response({
+            'status': 'error',
+            'message': 'Track not found'
+        }, 404)
 
-        db = get_db()
+    if inserted is None:
+        return json_response({
+            'status': 'error',
+            'message': 'You have already rated this track',
+            'existing_rating': existing_rating[0]
+        }, 409)
+
+    invalidate_cache()
+
+    thumbs_up, thumbs_down = ratings
+    return json_response({
+        'status': 'success',
+        'message': 'Rating submitted successfully',
+        'data': {
+            'thumbs_up': thumbs_up,
+            'thumbs_down': thumbs_down
+        }
+    })
 
-        # Mark all tracks as not current
-        db.execute('UPDATE tracks SET is_current = 0')
+@app.route('/api/tracks/<int:track_id>/rating-status', methods=['POST'])
+def get_rating_status(track_id):
+    data = request.get_json()
+    user_id = data.get('user_id')
 
-        # Check if this track already exists in recently played
-        existing = db.execute('''
-            SELECT id FROM tracks
-            WHERE artist = ? AND title = ?
-            ORDER BY played_at DESC LIMIT 1
-        ''', (artist, title)).fetchone()
+    if not user_id:
+        return json_response({
+            'status': 'error',
+            'message': 'user_id is required'
+        }, 400)
 
-        if existing:
-            # Update existing track to current
-            db.execute('''
-                UPDATE tracks
-                SET is_current = 1, played_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (existing['id'],))
-        else:
-            # Insert new track as current
-            db.execute('''
-                INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-                VALUES (?, ?, ?, ?, 1, ?)
-            ''', (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
+    db = get_db()
 
-        db.commit()
+    # Check if user has rated this track
+    existing_rating = db.execute(SQL_USER_RATING, (track_id, user_id)).fetchone()
 
-        return jsonify({
+    if existing_rating:
+        return json_response({
             'status': 'success',
-            'message': 'Track updated',
             'data': {
-                'artist': artist,
-                'title': title
+                'has_rated': True,
+                'rating_type': existing_rating[0]
             }
         })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    else:
+        return json_response({
+            'status': 'success',
+            'data': {
+                'has_rated': False,
+                'rating_type': None
+            }
+        })
+
+@app.route('/api/update-track', methods=['POST'])
+def update_track():
+    data = request.get_json()
+    artist = data.get('artist', 'Unknown Artist')
+    title = data.get('title', 'Unknown Track')
+    album = data.get('album', 'Live Stream')
+    year = data.get('year')
+
+    db = get_db()
+
+    with db:
+        begin_immediate(db)
+        # Only the previous current track needs clearing (index probe)
+        db.execute(SQL_CLEAR_CURRENT)
+
+        # Insert new track as current, or bring a replayed one back
+        db.execute(SQL_UPSERT_CURRENT, (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
+    invalidate_cache()
+
+    return json_response({
+        'status': 'success',
+        'message': 'Track updated',
+        'data': {
+            'artist': artist,
+            'title': title
+        }
+    })
 
 @app.route('/tracks')
 def view_tracks():
-    try:
-        db = get_db()
-        cursor = db.execute('''
-            SELECT id, artist, title, album, year, is_current, played_at
-            FROM tracks
-            ORDER BY is_current DESC, played_at DESC
-        ''')
-        tracks = cursor.fetchall()
-
-        html = '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Radio Calico - Tracks Database</title>
-            <style>
-                body { font-family: Arial, sans-serif; max-width: 1400px; margin: 30px auto; padding: 20px; }
-                h1 { color: #1F4E23; }
-                table { width: 100%; border-collapse: collapse; margin: 20px 0; }
-                th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-                th { background-color: #1F4E23; color: white; position: sticky; top: 0; }
-                tr:hover { background-color: #D8F2D5; }
-                .current { background-color: #38A29D; color: white; font-weight: bold; }
-                .badge { display: inline-block; padding: 4px 8px; border-radius: 4px; font-size: 12px; }
-                .badge-current { background: #EFA63C; color: white; }
-                a { color: #1F4E23; text-decoration: none; }
-                a:hover { text-decoration: underline; }
-            </style>
-        </head>
-        <body>
-            <h1>Radio Calico - Tracks Database</h1>
-            <p><a href="/">&larr; Back to API Home</a></p>
-            <table>
-                <thead>
-                    <tr>
-                        <th>ID</th>
-                        <th>Artist</th>
-                        <th>Title</th>
-                        <th>Album</th>
-                        <th>Year</th>
-                        <th>Status</th>
-                        <th>Played At</th>
-                    </tr>
-                </thead>
-                <tbody>
-        '''
-
-        for track in tracks:
-            status = '<span class="badge badge-current">NOW PLAYING</span>' if track['is_current'] else 'Recently Played'
-            html += f'''
-                <tr>
-                    <td>{track['id']}</td>
-                    <td><strong>{track['artist']}</strong></td>
-                    <td>{track['title']}</td>
-                    <td>{track['album']}</td>
-                    <td>{track['year'] or 'N/A'}</td>
-                    <td>{status}</td>
-                    <td>{track['played_at']}</td>
-                </tr>
-            '''
-
-        html += '''
-                </tbody>
-            </table>
-        </body>
-        </html>
-        '''
-        return html
-    except Exception as e:
-        return f'<h1>Error</h1><p>{str(e)}</p>', 500
+    db = get_db()
+    cursor = db.execute('''
+        SELECT id, artist, title, album, year, is_current, played_at
+        FROM tracks
+        ORDER BY is_current DESC, played_at DESC
+    ''')
+
+    # Rows are rendered as SQLite steps through them, so memory stays flat
+    # and the browser gets the page header straight away
+    return stream_page('tracks.html', tracks=cursor)
 
 @app.route('/ratings')
 def view_ratings():
-    try:
-        db = get_db()
-        cursor = db.execute('''
-            SELECT
-                r.id,
-                r.track_id,
-                t.artist,
-                t.title,
-                r.user_id,
-                r.rating_type,
-                r.created_at
-            FROM ratings r
-            JOIN tracks t ON r.track_id = t.id
-            ORDER BY r.created_at DESC
-        ''')
-        ratings = cursor.fetchall()
-
-        html = '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Radio Calico - Ratings Database</title>
-            <style>
-                body { font-family: Arial, sans-serif; max-width: 1400px; margin: 30px auto; padding: 20px; }
-                h1 { color: #1F4E23; }
-                table { width: 100%; border-collapse: collapse; margin: 20px 0; }
-                th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-                th { background-color: #1F4E23; color: white; position: sticky; top: 0; }
-                tr:hover { background-color: #D8F2D5; }
-                .badge { display: inline-block; padding: 4px 8px; border-radius: 4px; font-size: 14px; }
-                .badge-up { background: #38A29D; color: white; }
-                .badge-down { background: #EFA63C; color: white; }
-                a { color: #1F4E23; text-decoration: none; }
-                a:hover { text-decoration: underline; }
-                .stats { background: #f5f5f5; padding: 15px; margin: 20px 0; border-left: 4px solid #38A29D; }
-            </style>
-        </head>
-        <body>
-            <h1>Radio Calico - Ratings Database</h1>
-            <p><a href="/">&larr; Back to API Home</a> | <a href="/tracks">View Tracks</a></p>
-        '''
-
-        # Calculate statistics
-        thumbs_up_count = sum(1 for r in ratings if r['rating_type'] == 1)
-        thumbs_down_count = sum(1 for r in ratings if r['rating_type'] == -1)
-        total_ratings = len(ratings)
-
-        html += f'''
-            <div class="stats">
-                <h3 style="margin-top: 0;">Rating Statistics</h3>
-                <p><strong>Total Ratings:</strong> {total_ratings}</p>
-                <p><strong>Thumbs Up:</strong> {thumbs_up_count} ({(thumbs_up_count/total_ratings*100) if total_ratings > 0 else 0:.1f}%)</p>
-                <p><strong>Thumbs Down:</strong> {thumbs_down_count} ({(thumbs_down_count/total_ratings*100) if total_ratings > 0 else 0:.1f}%)</p>
-            </div>
-            <table>
-                <thead>
-                    <tr>
-                        <th>ID</th>
-                        <th>Track ID</th>
-                        <th>Artist</th>
-                        <th>Title</th>
-                        <th>User ID</th>
-                        <th>Rating</th>
-                        <th>Created At</th>
-                    </tr>
-                </thead>
-                <tbody>
-        '''
-
-        if ratings:
-            for rating in ratings:
-                rating_badge = '<span class="badge badge-up">👍 Thumbs Up</span>' if rating['rating_type'] == 1 else '<span class="badge badge-down">👎 Thumbs Down</span>'
-                html += f'''
-                    <tr>
-                        <td>{rating['id']}</td>
-                        <td>{rating['track_id']}</td>
-                        <td><strong>{rating['artist']}</strong></td>
-                        <td>{rating['title']}</td>
-                        <td>{rating['user_id']}</td>
-                        <td>{rating_badge}</td>
-                        <td>{rating['created_at']}</td>
-                    </tr>
-                '''
-        else:
-            html += '''
-                <tr>
-                    <td colspan="7" style="text-align: center; padding: 40px; color: #999;">
-                        No ratings yet. Start listening and rate some tracks!
-                    </td>
-                </tr>
-            '''
-
-        html += '''
-                </tbody>
-            </table>
-        </body>
-        </html>
-        '''
-        return html
-    except Exception as e:
-        return f'<h1>Error</h1><p>{str(e)}</p>', 500
+    db = get_db()
+    # Statistics come from a separate aggregate over ratings, so the rows
+    # below can be streamed without being collected first
+    total_ratings, thumbs_up_count, thumbs_down_count = db.execute('''
+        SELECT
+            COUNT(*),
+            COALESCE(SUM(rating_type = 1), 0),
+            COALESCE(SUM(rating_type = -1), 0)
+        FROM ratings
+    ''').fetchone()
+
+    cursor = db.execute('''
+        SELECT
+            r.id,
+            r.track_id,
+            t.artist,
+            t.title,
+            r.user_id,
+            r.rating_type,
+            r.created_at
+        FROM ratings r
+        JOIN tracks t ON r.track_id = t.id
+        ORDER BY r.created_at DESC
+    ''')
+
+    return stream_page(
+        'ratings.html',
+        ratings=cursor,
+        total_ratings=total_ratings,
+        thumbs_up_count=thumbs_up_count,
+        thumbs_down_count=thumbs_down_count
+    )
 
 if __name__ == '__main__':
     init_db()
     port = int(os.getenv('FLASK_PORT', 5000))
     debug_mode = os.getenv('FLASK_ENV', 'production') == 'development'
-    app.run(debug=debug_mode, host='0.0.0.0', port=port)
+    if debug_mode:
+        # FLASK_TRACK_ROTATOR=1 runs the simulated rotation on a thread here
+        # instead of as a second process. Only in the reloader's serving
+        # child; the watcher parent serves nothing.
+        if os.getenv('FLASK_TRACK_ROTATOR') == '1' and os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+            import track_rotator
+            track_rotator.DATABASE = app.config['DATABASE']
+            threading.Thread(target=track_rotator.run, name='track-rotator', daemon=True).start()
+        app.run(debug=True, host='0.0.0.0', port=port)
+    else:
+        # app.run() is Werkzeug's development server, not meant for
+        # production; hand the process over to gunicorn, whose gevent
+        # workers each serve many requests cooperatively. It is started
+        # as `python -m gunicorn` with this interpreter because the systemd
+        # unit runs the venv's python without venv/bin on PATH.
+        workers = os.getenv('FLASK_WORKERS', '4')
+        os.execv(sys.executable, [
+            sys.executable, '-m', 'gunicorn', '-k', 'gevent', '-w', workers,
+            f'--bind=0.0.0.0:{port}',
+            f'--chdir={os.path.dirname(os.path.abspath(__file__))}',
+            'flask_app:app'
+        ])
@@ -1,14 +1,28 @@
 import os
+import sys
+import threading
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from functools import wraps
+from psycopg2.extras import RealDictCursor, execute_values
 from psycopg2 import pool
-from flask import Flask, jsonify, g, request
+from flask import Flask, Response, jsonify, g, request, stream_with_context
 from flask_cors import CORS
+from gevent import monkey
 from dotenv import load_dotenv
 from datetime import datetime
+from markupsafe import escape
+from werkzeug.exceptions import HTTPException
 
 load_dotenv()
 
+# gunicorn's gevent workers patch sockets, but libpq does its own I/O;
+# psycogreen makes psycopg2 yield to other greenlets while it waits on
+# the server instead of blocking the whole worker
+if monkey.is_module_patched('socket'):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
 app = Flask(__name__)
 CORS(app)
 
@@ -21,37 +35,225 @@ POSTGRES_CONFIG = {
     'password': os.getenv('POSTGRES_PASSWORD', 'radiocalico')
 }
 
-# Create a connection pool for better performance
+# Hot queries are prepared server-side once per connection, so PostgreSQL
+# skips parsing and planning on every request. Routes run them with
+# EXECUTE <name>.
+PREPARED_STATEMENTS = {
+    # The current track and its rating counts in one round trip
+    'now_playing': '''
+        SELECT t.id, t.artist, t.title, t.album, t.year, t.album_art_url, t.played_at,
+            COUNT(*) FILTER (WHERE r.rating_type = 1) as thumbs_up,
+            COUNT(*) FILTER (WHERE r.rating_type = -1) as thumbs_down
+        FROM tracks t
+        LEFT JOIN ratings r ON r.track_id = t.id
+        WHERE t.is_current = TRUE
+        GROUP BY t.id
+        LIMIT 1
+    ''',
+    'user_rating': '''
+        SELECT rating_type FROM ratings
+        WHERE track_id = $1 AND user_id = $2
+    ''',
+    # Insert the rating and get updated rating counts in one statement.
+    # The outer SELECT runs on the statement's snapshot, which does not
+    # include the new row, so the inserted rating is added back in; on that
+    # same snapshot existing_rating is the user's earlier rating, if any.
+    # An unknown track fails the foreign key.
+    'insert_rating': '''
+        WITH inserted AS (
+            INSERT INTO ratings (track_id, user_id, rating_type)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (track_id, user_id) DO NOTHING
+            RETURNING rating_type
+        )
+        SELECT
+            (SELECT COUNT(*) FROM inserted) = 1 as inserted,
+            (SELECT rating_type FROM ratings
+             WHERE track_id = $1 AND user_id = $2) as existing_rating,
+            COUNT(*) FILTER (WHERE rating_type = 1) as thumbs_up,
+            COUNT(*) FILTER (WHERE rating_type = -1) as thumbs_down
+        FROM (
+            SELECT rating_type FROM ratings WHERE track_id = $1
+            UNION ALL
+            SELECT rating_type FROM inserted
+        ) AS track_ratings
+    ''',
+    # Clearing has to be its own statement ahead of the upsert: the partial
+    # unique index on is_current is checked as each row is written, and
+    # sub-statements of one query give no ordering guarantee
+    'clear_current': 'UPDATE tracks SET is_current = FALSE WHERE is_current = TRUE',
+    'upsert_current': '''
+        INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
+        VALUES ($1, $2, $3, $4, TRUE, $5)
+        ON CONFLICT (artist, title) DO UPDATE
+        SET is_current = TRUE, played_at = CURRENT_TIMESTAMP
+    ''',
+}
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether PREPARED_STATEMENTS exist on it"""
+    prepared = False
+
+# Create a connection pool for better performance. Requests are served from
+# several threads, so this has to be the thread-safe pool; size it against
+# the server's max_connections.
 connection_pool = None
+connection_pool_lock = threading.Lock()
 
 def get_pool():
     """Get or create the connection pool"""
     global connection_pool
     if connection_pool is None:
-        connection_pool = pool.SimpleConnectionPool(
-            1,  # min connections
-            10,  # max connections
-            **POSTGRES_CONFIG
-        )
+        with connection_pool_lock:
+            if connection_pool is None:
+                connection_pool = pool.ThreadedConnectionPool(
+                    int(os.getenv('POSTGRES_POOL_MIN', 5)),
+                    int(os.getenv('POSTGRES_POOL_MAX', 25)),
+                    connection_factory=PooledConnection,
+                    **POSTGRES_CONFIG
+                )
     return connection_pool
 
 def get_db():
-    """Get a database connection from the pool"""
-    try:
-        pool = get_pool()
-        conn = pool.getconn()
-        conn.cursor_factory = RealDictCursor
-        return conn
-    except psycopg2.Error as e:
-        raise Exception(f"Database connection failed: {e}")
+    """Get this request's database connection, checking one out on first use"""
+    db = getattr(g, '_database', None)
+    if db is None:
+        try:
+            db = get_pool().getconn()
+        except psycopg2.Error as e:
+            raise Exception(f"Database connection failed: {e}")
+        db.cursor_factory = RealDictCursor
+        if not db.prepared:
+            # Prepared statements live as long as the session, so this runs
+            # once per pooled connection (after init_db created the tables)
+            with db.cursor() as cursor:
+                for name, query in PREPARED_STATEMENTS.items():
+                    cursor.execute(f'PREPARE {name} AS {query}')
+            db.commit()
+            db.prepared = True
+        g._database = db
+    return db
 
 @app.teardown_appcontext
 def close_connection(exception):
     """Return connection to pool"""
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        pool = get_pool()
-        pool.putconn(db)
+        # Don't hand the next request a connection stuck in an open or
+        # aborted transaction; drop it from the pool if it has gone bad
+        try:
+            if db.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                db.rollback()
+        except psycopg2.Error:
+            pass
+        get_pool().putconn(db, close=bool(db.closed))
+
+# Same error responses as flask_app.py. The connection still goes back to
+# the pool, rolled back, in close_connection.
+@app.errorhandler(Exception)
+def handle_exception(e):
+    if request.path.startswith('/api/'):
+        code = e.code if isinstance(e, HTTPException) else 500
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), code
+    if isinstance(e, HTTPException):
+        return e
+    return f'<h1>Error</h1><p>{escape(str(e))}</p>', 500
+
+# Short-lived in-process cache for the endpoints every listener polls. The
+# track changes at most once per metadata poll (15 s), and writes made
+# through this app drop the cache straight away.
+CACHE_TTL = 3  # seconds
+_cache = {}
+_cache_lock = threading.Lock()
+
+def cached_json(view):
+    """Serve a successful JSON response from the cache until it expires"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        now = time.monotonic()
+        entry = _cache.get(view.__name__)
+        if entry is not None and entry[0] > now:
+            return Response(entry[1], mimetype='application/json')
+
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            with _cache_lock:
+                _cache[view.__name__] = (now + CACHE_TTL, response.get_data())
+        return response
+    return wrapper
+
+def invalidate_cache():
+    """Drop cached responses after a write"""
+    with _cache_lock:
+        _cache.clear()
+
+# Tables and indexes, sent to PostgreSQL as one batch by init_db()
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS posts (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS tracks (
+        id SERIAL PRIMARY KEY,
+        artist TEXT NOT NULL,
+        title TEXT NOT NULL,
+        album TEXT,
+        year INTEGER,
+        album_art_url TEXT,
+        played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_current BOOLEAN DEFAULT FALSE
+    );
+
+    CREATE TABLE IF NOT EXISTS ratings (
+        id SERIAL PRIMARY KEY,
+        track_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        rating_type INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (track_id) REFERENCES tracks (id),
+        UNIQUE (track_id, user_id)
+    );
+
+    -- Per-track thumbs up/down counts can be answered from the index
+    -- alone (the UNIQUE constraint's index doesn't carry rating_type)
+    CREATE INDEX IF NOT EXISTS idx_ratings_track_rating ON ratings (track_id, rating_type);
+    -- Recently played: newest non-current tracks
+    CREATE INDEX IF NOT EXISTS idx_tracks_recent ON tracks (played_at DESC) WHERE is_current = FALSE;
+    -- Now playing is a single-entry index probe, and at most one
+    -- track can be marked current
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_tracks_current ON tracks (is_current) WHERE is_current = TRUE;
+    -- One row per song; update-track upserts against this
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_tracks_artist_title ON tracks (artist, title);
+
+    -- Recently played only changes when the track does, so it is kept
+    -- precomputed; writers run REFRESH_RECENT_TRACKS after changing tracks.
+    -- The unique index is what allows a concurrent refresh.
+    CREATE MATERIALIZED VIEW IF NOT EXISTS recent_tracks AS
+        SELECT artist, title, album, year, played_at
+        FROM tracks
+        WHERE is_current = FALSE
+        ORDER BY played_at DESC
+        LIMIT 5;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_recent_tracks ON recent_tracks (artist, title);
+'''
+
+# Readers of recent_tracks are not blocked while it is rebuilt
+REFRESH_RECENT_TRACKS = 'REFRESH MATERIALIZED VIEW CONCURRENTLY recent_tracks'
 
 def init_db():
     """Initialize database tables"""
@@ -60,58 +262,12 @@ def init_db():
 
     for attempt in range(max_retries):
         try:
-            conn = get_db()
+            conn = get_pool().getconn()
+            conn.cursor_factory = RealDictCursor
             cursor = conn.cursor()
 
-            # Create users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username TEXT NOT NULL UNIQUE,
-                    email TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            # Create posts table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS posts (
-                    id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    user_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-
-            # Create tracks table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tracks (
-                    id SERIAL PRIMARY KEY,
-                    artist TEXT NOT NULL,
-                    title TEXT NOT NULL,
-                    album TEXT,
-                    year INTEGER,
-                    album_art_url TEXT,
-                    played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_current BOOLEAN DEFAULT FALSE
-                )
-            ''')
-
-            # Create ratings table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ratings (
-                    id SERIAL PRIMARY KEY,
-                    track_id INTEGER NOT NULL,
-                    user_id TEXT NOT NULL,
-                    rating_type INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (track_id) REFERENCES tracks (id),
-                    UNIQUE (track_id, user_id)
-                )
-            ''')
-
+            # The whole schema goes over in one round trip
+            cursor.execute(SCHEMA_SQL)
             conn.commit()
 
             # Seed with sample data
@@ -126,7 +282,6 @@ def init_db():
         except psycopg2.Error as e:
             print(f'PostgreSQL connection attempt {attempt + 1}/{max_retries} failed: {e}')
             if attempt < max_retries - 1:
-                import time
                 time.sleep(retry_delay)
             else:
                 raise Exception(f"Failed to connect to PostgreSQL after {max_retries} attempts: {e}")
@@ -151,13 +306,12 @@ def seed_sample_tracks(cursor, conn):
         ('Etta James', 'I\'d Rather Go Blind', 'Tell Mama', 1967, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Etta'),
     ]
 
-    # Insert tracks with the first one as current
-    for i, (artist, title, album, year, art_url) in enumerate(sample_tracks):
-        is_current = True if i == 0 else False
-        cursor.execute('''
-            INSERT INTO tracks (artist, title, album, year, album_art_url, is_current)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        ''', (artist, title, album, year, art_url, is_current))
+    # Insert tracks with the first one as current, as one multi-row INSERT
+    execute_values(cursor, '''
+        INSERT INTO tracks (artist, title, album, year, album_art_url, is_current)
+        VALUES %s
+    ''', [track + (i == 0,) for i, track in enumerate(sample_tracks)])
+    cursor.execute(REFRESH_RECENT_TRACKS)
 
     conn.commit()
 
@@ -215,534 +369,340 @@ def home():
 
 @app.route('/api/test')
 def test_db():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('SELECT 1 as test')
-        result = cursor.fetchone()
-        cursor.close()
-        get_pool().putconn(db)
-        return jsonify({
-            'status': 'success',
-            'message': 'Database connection working',
-            'database': 'PostgreSQL',
-            'result': result
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('SELECT 1 as test')
+    result = cursor.fetchone()
+    cursor.close()
+    return jsonify({
+        'status': 'success',
+        'message': 'Database connection working',
+        'database': 'PostgreSQL',
+        'result': result
+    })
+
+# The stream URL only changes on redeploy, so read it once at import
+# rather than on every request. None means the file is missing.
+STREAM_URL_PATH = os.path.join(os.path.dirname(__file__), 'stream_URL.txt')
+try:
+    with open(STREAM_URL_PATH, 'r') as f:
+        STREAM_URL = f.read().strip()
+except FileNotFoundError:
+    STREAM_URL = None
 
 @app.route('/api/stream-url')
 def get_stream_url():
     """Get the HLS stream URL from stream_URL.txt file"""
-    try:
-        stream_url_path = os.path.join(os.path.dirname(__file__), 'stream_URL.txt')
-        with open(stream_url_path, 'r') as f:
-            stream_url = f.read().strip()
-        return jsonify({
-            'status': 'success',
-            'streamUrl': stream_url
-        })
-    except FileNotFoundError:
+    if STREAM_URL is None:
         return jsonify({
             'status': 'error',
             'message': 'Stream URL file not found'
         }), 404
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return jsonify({
+        'status': 'success',
+        'streamUrl': STREAM_URL
+    })
+
+PAGE_LIMIT_DEFAULT = 100
+PAGE_LIMIT_MAX = 1000
+
+def page_args():
+    """Read ?limit=&offset= pagination, clamped to sane bounds"""
+    limit = request.args.get('limit', PAGE_LIMIT_DEFAULT, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    return max(1, min(limit, PAGE_LIMIT_MAX)), max(0, offset)
+
+def json_rows_response(cursor):
+    """Stream a success envelope around a cursor's rows, one row at a time"""
+    def generate():
+        yield '{"status":"success","data":['
+        for i, row in enumerate(cursor):
+            yield (',' if i else '') + app.json.dumps(row)
+        cursor.close()
+        yield ']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/users')
 def get_users():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('SELECT * FROM users')
-        users = cursor.fetchall()
-        cursor.close()
-        get_pool().putconn(db)
-        return jsonify({
-            'status': 'success',
-            'data': users
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    limit, offset = page_args()
+    cursor = get_db().cursor(name='users_stream')
+    cursor.itersize = 500
+    cursor.execute('SELECT * FROM users ORDER BY id LIMIT %s OFFSET %s', (limit, offset))
+    return json_rows_response(cursor)
 
 @app.route('/api/posts')
 def get_posts():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('SELECT * FROM posts')
-        posts = cursor.fetchall()
+    limit, offset = page_args()
+    cursor = get_db().cursor(name='posts_stream')
+    cursor.itersize = 500
+    cursor.execute('SELECT * FROM posts ORDER BY id LIMIT %s OFFSET %s', (limit, offset))
+    return json_rows_response(cursor)
+
+@app.route('/api/now-playing')
+@cached_json
+def now_playing():
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('EXECUTE now_playing')
+    track = cursor.fetchone()
+
+    if track:
         cursor.close()
-        get_pool().putconn(db)
         return jsonify({
             'status': 'success',
-            'data': posts
+            'data': track
         })
-    except Exception as e:
+    else:
+        cursor.close()
         return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+            'status': 'success',
+            'data': {
+                'id': None,
+                'artist': 'Radio Calico',
+                'title': '24-bit Lossless Streaming',
+                'album': 'Crystal-Clear Audio',
+                'year': None,
+                'album_art_url': 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Radio+Calico',
+                'played_at': None,
+                'thumbs_up': 0,
+                'thumbs_down': 0
+            }
+        })
 
-@app.route('/api/now-playing')
-def now_playing():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT id, artist, title, album, year, album_art_url
-            FROM tracks
-            WHERE is_current = TRUE
-            LIMIT 1
-        ''')
-        track = cursor.fetchone()
-
-        if track:
-            # Get ratings for this track
-            cursor.execute('''
-                SELECT
-                    SUM(CASE WHEN rating_type = 1 THEN 1 ELSE 0 END) as thumbs_up,
-                    SUM(CASE WHEN rating_type = -1 THEN 1 ELSE 0 END) as thumbs_down
-                FROM ratings
-                WHERE track_id = %s
-            ''', (track['id'],))
-            ratings = cursor.fetchone()
-            track['thumbs_up'] = ratings['thumbs_up'] or 0
-            track['thumbs_down'] = ratings['thumbs_down'] or 0
+@app.route('/api/recently-played')
+def recently_played():
+    db = get_db()
+    cursor = db.cursor()
+    # Five precomputed rows, refreshed whenever the current track changes
+    cursor.execute('''
+        SELECT artist, title, album, year, played_at
+        FROM recent_tracks
+        ORDER BY played_at DESC
+    ''')
+    tracks = cursor.fetchall()
+    cursor.close()
+
+    return jsonify({
+        'status': 'success',
+        'data': tracks
+    })
 
-            cursor.close()
-            get_pool().putconn(db)
+@app.route('/api/tracks/<int:track_id>/rate', methods=['POST'])
+def rate_track(track_id):
+    data = request.get_json()
+    user_id = data.get('user_id')
+    rating_type = data.get('rating_type')  # 1 for thumbs up, -1 for thumbs down
 
-            return jsonify({
-                'status': 'success',
-                'data': track
-            })
-        else:
-            cursor.close()
-            get_pool().putconn(db)
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'id': None,
-                    'artist': 'Radio Calico',
-                    'title': '24-bit Lossless Streaming',
-                    'album': 'Crystal-Clear Audio',
-                    'year': None,
-                    'album_art_url': 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Radio+Calico',
-                    'thumbs_up': 0,
-                    'thumbs_down': 0
-                }
-            })
-    except Exception as e:
+    if not user_id:
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
-
-@app.route('/api/recently-played')
-def recently_played():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT artist, title, album, year, played_at
-            FROM tracks
-            WHERE is_current = FALSE
-            ORDER BY played_at DESC
-            LIMIT 5
-        ''')
-        tracks = cursor.fetchall()
-        cursor.close()
-        get_pool().putconn(db)
+            'message': 'user_id is required'
+        }), 400
 
-        return jsonify({
-            'status': 'success',
-            'data': tracks
-        })
-    except Exception as e:
+    if rating_type not in [1, -1]:
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': 'rating_type must be 1 (thumbs up) or -1 (thumbs down)'
+        }), 400
 
-@app.route('/api/tracks/<int:track_id>/rate', methods=['POST'])
-def rate_track(track_id):
+    db = get_db()
+    cursor = db.cursor()
+
+    # Existence check, duplicate check and insert are one round trip
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        rating_type = data.get('rating_type')  # 1 for thumbs up, -1 for thumbs down
-
-        if not user_id:
-            return jsonify({
-                'status': 'error',
-                'message': 'user_id is required'
-            }), 400
-
-        if rating_type not in [1, -1]:
-            return jsonify({
-                'status': 'error',
-                'message': 'rating_type must be 1 (thumbs up) or -1 (thumbs down)'
-            }), 400
-
-        db = get_db()
-        cursor = db.cursor()
-
-        # Check if track exists
-        cursor.execute('SELECT id FROM tracks WHERE id = %s', (track_id,))
-        track = cursor.fetchone()
-        if not track:
-            cursor.close()
-            get_pool().putconn(db)
-            return jsonify({
-                'status': 'error',
-                'message': 'Track not found'
-            }), 404
-
-        # Check if user has already rated this track
-        cursor.execute('''
-            SELECT rating_type FROM ratings
-            WHERE track_id = %s AND user_id = %s
-        ''', (track_id, user_id))
-        existing_rating = cursor.fetchone()
-
-        if existing_rating:
-            cursor.close()
-            get_pool().putconn(db)
-            return jsonify({
-                'status': 'error',
-                'message': 'You have already rated this track',
-                'existing_rating': existing_rating['rating_type']
-            }), 409
-
-        # Insert the rating
-        cursor.execute('''
-            INSERT INTO ratings (track_id, user_id, rating_type)
-            VALUES (%s, %s, %s)
-        ''', (track_id, user_id, rating_type))
-
-        # Get updated rating counts
-        cursor.execute('''
-            SELECT
-                SUM(CASE WHEN rating_type = 1 THEN 1 ELSE 0 END) as thumbs_up,
-                SUM(CASE WHEN rating_type = -1 THEN 1 ELSE 0 END) as thumbs_down
-            FROM ratings
-            WHERE track_id = %s
-        ''', (track_id,))
-        ratings = cursor.fetchone()
-
-        db.commit()
+        cursor.execute('EXECUTE insert_rating (%s, %s, %s)', (track_id, user_id, rating_type))
+    except psycopg2.errors.ForeignKeyViolation:
+        db.rollback()
         cursor.close()
-        get_pool().putconn(db)
-
         return jsonify({
-            'status': 'success',
-            'message': 'Rating submitted successfully',
-            'data': {
-                'thumbs_up': ratings['thumbs_up'] or 0,
-                'thumbs_down': ratings['thumbs_down'] or 0
-            }
-        })
-    except Exception as e:
+            'status': 'error',
+            'message': 'Track not found'
+        }), 404
+    ratings = cursor.fetchone()
+
+    db.commit()
+    cursor.close()
+
+    if not ratings['inserted']:
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': 'You have already rated this track',
+            'existing_rating': ratings['existing_rating']
+        }), 409
+
+    invalidate_cache()
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Rating submitted successfully',
+        'data': {
+            'thumbs_up': ratings['thumbs_up'],
+            'thumbs_down': ratings['thumbs_down']
+        }
+    })
 
 @app.route('/api/tracks/<int:track_id>/rating-status', methods=['POST'])
 def get_rating_status(track_id):
-    try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-
-        if not user_id:
-            return jsonify({
-                'status': 'error',
-                'message': 'user_id is required'
-            }), 400
-
-        db = get_db()
-        cursor = db.cursor()
-
-        # Check if user has rated this track
-        cursor.execute('''
-            SELECT rating_type FROM ratings
-            WHERE track_id = %s AND user_id = %s
-        ''', (track_id, user_id))
-        existing_rating = cursor.fetchone()
-        cursor.close()
-        get_pool().putconn(db)
-
-        if existing_rating:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'has_rated': True,
-                    'rating_type': existing_rating['rating_type']
-                }
-            })
-        else:
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'has_rated': False,
-                    'rating_type': None
-                }
-            })
-    except Exception as e:
+    data = request.get_json()
+    user_id = data.get('user_id')
+
+    if not user_id:
         return jsonify({
             'status': 'error',
-            'message': str(e)
-        }), 500
+            'message': 'user_id is required'
+        }), 400
 
-@app.route('/api/update-track', methods=['POST'])
-def update_track():
-    try:
-        data = request.get_json()
-        artist = data.get('artist', 'Unknown Artist')
-        title = data.get('title', 'Unknown Track')
-        album = data.get('album', 'Live Stream')
-        year = data.get('year')
-
-        db = get_db()
-        cursor = db.cursor()
-
-        # Mark all tracks as not current
-        cursor.execute('UPDATE tracks SET is_current = FALSE')
-
-        # Check if this track already exists in recently played
-        cursor.execute('''
-            SELECT id FROM tracks
-            WHERE artist = %s AND title = %s
-            ORDER BY played_at DESC LIMIT 1
-        ''', (artist, title))
-        existing = cursor.fetchone()
-
-        if existing:
-            # Update existing track to current
-            cursor.execute('''
-                UPDATE tracks
-                SET is_current = TRUE, played_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            ''', (existing['id'],))
-        else:
-            # Insert new track as current
-            cursor.execute('''
-                INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-                VALUES (%s, %s, %s, %s, TRUE, %s)
-            ''', (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
-
-        db.commit()
-        cursor.close()
-        get_pool().putconn(db)
+    db = get_db()
+    cursor = db.cursor()
 
+    # Check if user has rated this track
+    cursor.execute('EXECUTE user_rating (%s, %s)', (track_id, user_id))
+    existing_rating = cursor.fetchone()
+    cursor.close()
+
+    if existing_rating:
         return jsonify({
             'status': 'success',
-            'message': 'Track updated',
             'data': {
-                'artist': artist,
-                'title': title
+                'has_rated': True,
+                'rating_type': existing_rating['rating_type']
             }
         })
-    except Exception as e:
+    else:
         return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+            'status': 'success',
+            'data': {
+                'has_rated': False,
+                'rating_type': None
+            }
+        })
+
+@app.route('/api/update-track', methods=['POST'])
+def update_track():
+    data = request.get_json()
+    artist = data.get('artist', 'Unknown Artist')
+    title = data.get('title', 'Unknown Track')
+    album = data.get('album', 'Live Stream')
+    year = data.get('year')
+
+    db = get_db()
+    cursor = db.cursor()
+
+    # Only the previous current track needs clearing (partial index)
+    cursor.execute('EXECUTE clear_current')
+
+    # Insert new track as current, or bring a replayed one back
+    cursor.execute('EXECUTE upsert_current (%s, %s, %s, %s, %s)',
+                   (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
+    cursor.execute(REFRESH_RECENT_TRACKS)
+
+    db.commit()
+    cursor.close()
+    invalidate_cache()
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Track updated',
+        'data': {
+            'artist': artist,
+            'title': title
+        }
+    })
+
+# Template events per socket write; see flask_app.py
+TEMPLATE_BUFFER_EVENTS = 256
+
+def stream_page(template, **context):
+    """Stream a template from templates/ (compiled once, autoescaped)"""
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template).stream(context)
+    stream.enable_buffering(TEMPLATE_BUFFER_EVENTS)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+def stream_cursor(db, name):
+    """Named (server-side) cursor yielding plain tuples in batches"""
+    cursor = db.cursor(name=name, cursor_factory=psycopg2.extensions.cursor)
+    cursor.itersize = 500
+    return cursor
 
 @app.route('/tracks')
 def view_tracks():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT id, artist, title, album, year, is_current, played_at
-            FROM tracks
-            ORDER BY is_current DESC, played_at DESC
-        ''')
-        tracks = cursor.fetchall()
-        cursor.close()
-        get_pool().putconn(db)
-
-        html = '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Radio Calico - Tracks Database (PostgreSQL)</title>
-            <style>
-                body { font-family: Arial, sans-serif; max-width: 1400px; margin: 30px auto; padding: 20px; }
-                h1 { color: #1F4E23; }
-                table { width: 100%; border-collapse: collapse; margin: 20px 0; }
-                th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-                th { background-color: #1F4E23; color: white; position: sticky; top: 0; }
-                tr:hover { background-color: #D8F2D5; }
-                .current { background-color: #38A29D; color: white; font-weight: bold; }
-                .badge { display: inline-block; padding: 4px 8px; border-radius: 4px; font-size: 12px; }
-                .badge-current { background: #EFA63C; color: white; }
-                a { color: #1F4E23; text-decoration: none; }
-                a:hover { text-decoration: underline; }
-            </style>
-        </head>
-        <body>
-            <h1>Radio Calico - Tracks Database (PostgreSQL)</h1>
-            <p><a href="/">&larr; Back to API Home</a></p>
-            <table>
-                <thead>
-                    <tr>
-                        <th>ID</th>
-                        <th>Artist</th>
-                        <th>Title</th>
-                        <th>Album</th>
-                        <th>Year</th>
-                        <th>Status</th>
-                        <th>Played At</th>
-                    </tr>
-                </thead>
-                <tbody>
-        '''
-
-        for track in tracks:
-            status = '<span class="badge badge-current">NOW PLAYING</span>' if track['is_current'] else 'Recently Played'
-            html += f'''
-                <tr>
-                    <td>{track['id']}</td>
-                    <td><strong>{track['artist']}</strong></td>
-                    <td>{track['title']}</td>
-                    <td>{track['album']}</td>
-                    <td>{track['year'] or 'N/A'}</td>
-                    <td>{status}</td>
-                    <td>{track['played_at']}</td>
-                </tr>
-            '''
-
-        html += '''
-                </tbody>
-            </table>
-        </body>
-        </html>
-        '''
-        return html
-    except Exception as e:
-        return f'<h1>Error</h1><p>{str(e)}</p>', 500
+    db = get_db()
+    # Rows arrive from PostgreSQL in batches of itersize as the page is
+    # written out, never all at once
+    cursor = stream_cursor(db, 'tracks_stream')
+    cursor.execute('''
+        SELECT id, artist, title, album, year, is_current, played_at
+        FROM tracks
+        ORDER BY is_current DESC, played_at DESC
+    ''')
+
+    return stream_page('tracks.html', tracks=cursor, backend='PostgreSQL')
 
 @app.route('/ratings')
 def view_ratings():
-    try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT
-                r.id,
-                r.track_id,
-                t.artist,
-                t.title,
-                r.user_id,
-                r.rating_type,
-                r.created_at
-            FROM ratings r
-            JOIN tracks t ON r.track_id = t.id
-            ORDER BY r.created_at DESC
-        ''')
-        ratings = cursor.fetchall()
-        cursor.close()
-        get_pool().putconn(db)
-
-        html = '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Radio Calico - Ratings Database (PostgreSQL)</title>
-            <style>
-                body { font-family: Arial, sans-serif; max-width: 1400px; margin: 30px auto; padding: 20px; }
-                h1 { color: #1F4E23; }
-                table { width: 100%; border-collapse: collapse; margin: 20px 0; }
-                th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-                th { background-color: #1F4E23; color: white; position: sticky; top: 0; }
-                tr:hover { background-color: #D8F2D5; }
-                .badge { display: inline-block; padding: 4px 8px; border-radius: 4px; font-size: 14px; }
-                .badge-up { background: #38A29D; color: white; }
-                .badge-down { background: #EFA63C; color: white; }
-                a { color: #1F4E23; text-decoration: none; }
-                a:hover { text-decoration: underline; }
-                .stats { background: #f5f5f5; padding: 15px; margin: 20px 0; border-left: 4px solid #38A29D; }
-            </style>
-        </head>
-        <body>
-            <h1>Radio Calico - Ratings Database (PostgreSQL)</h1>
-            <p><a href="/">&larr; Back to API Home</a> | <a href="/tracks">View Tracks</a></p>
-        '''
-
-        # Calculate statistics
-        thumbs_up_count = sum(1 for r in ratings if r['rating_type'] == 1)
-        thumbs_down_count = sum(1 for r in ratings if r['rating_type'] == -1)
-        total_ratings = len(ratings)
-
-        html += f'''
-            <div class="stats">
-                <h3 style="margin-top: 0;">Rating Statistics</h3>
-                <p><strong>Total Ratings:</strong> {total_ratings}</p>
-                <p><strong>Thumbs Up:</strong> {thumbs_up_count} ({(thumbs_up_count/total_ratings*100) if total_ratings > 0 else 0:.1f}%)</p>
-                <p><strong>Thumbs Down:</strong> {thumbs_down_count} ({(thumbs_down_count/total_ratings*100) if total_ratings > 0 else 0:.1f}%)</p>
-            </div>
-            <table>
-                <thead>
-                    <tr>
-                        <th>ID</th>
-                        <th>Track ID</th>
-                        <th>Artist</th>
-                        <th>Title</th>
-                        <th>User ID</th>
-                        <th>Rating</th>
-                        <th>Created At</th>
-                    </tr>
-                </thead>
-                <tbody>
-        '''
-
-        if ratings:
-            for rating in ratings:
-                rating_badge = '<span class="badge badge-up">👍 Thumbs Up</span>' if rating['rating_type'] == 1 else '<span class="badge badge-down">👎 Thumbs Down</span>'
-                html += f'''
-                    <tr>
-                        <td>{rating['id']}</td>
-                        <td>{rating['track_id']}</td>
-                        <td><strong>{rating['artist']}</strong></td>
-                        <td>{rating['title']}</td>
-                        <td>{rating['user_id']}</td>
-                        <td>{rating_badge}</td>
-                        <td>{rating['created_at']}</td>
-                    </tr>
-                '''
-        else:
-            html += '''
-                <tr>
-                    <td colspan="7" style="text-align: center; padding: 40px; color: #999;">
-                        No ratings yet. Start listening and rate some tracks!
-                    </td>
-                </tr>
-            '''
-
-        html += '''
-                </tbody>
-            </table>
-        </body>
-        </html>
-        '''
-        return html
-    except Exception as e:
-        return f'<h1>Error</h1><p>{str(e)}</p>', 500
+    limit, offset = page_args()
+    db = get_db()
+
+    # Statistics over every rating come from one aggregate; only the
+    # current page of rows is transferred
+    cursor = db.cursor()
+    cursor.execute('''
+        SELECT
+            COUNT(*) as total,
+            COUNT(*) FILTER (WHERE rating_type = 1) as thumbs_up,
+            COUNT(*) FILTER (WHERE rating_type = -1) as thumbs_down
+        FROM ratings
+    ''')
+    stats = cursor.fetchone()
+    cursor.close()
+    total_ratings = stats['total']
+
+    cursor = stream_cursor(db, 'ratings_stream')
+    cursor.execute('''
+        SELECT
+            r.id,
+            r.track_id,
+            t.artist,
+            t.title,
+            r.user_id,
+            r.rating_type,
+            r.created_at
+        FROM ratings r
+        JOIN tracks t ON r.track_id = t.id
+        ORDER BY r.created_at DESC, r.id DESC
+        LIMIT %s OFFSET %s
+    ''', (limit, offset))
+
+    return stream_page(
+        'ratings.html',
+        ratings=cursor,
+        backend='PostgreSQL',
+        total_ratings=total_ratings,
+        thumbs_up_count=stats['thumbs_up'],
+        thumbs_down_count=stats['thumbs_down'],
+        limit=limit,
+        newer_offset=max(0, offset - limit) if offset > 0 else None,
+        older_offset=offset + limit if offset + limit < total_ratings else None
+    )
 
 if __name__ == '__main__':
     init_db()
     port = int(os.getenv('FLASK_PORT', 5000))
     debug_mode = os.getenv('FLASK_ENV', 'production') == 'development'
-    app.run(debug=debug_mode, host='0.0.0.0', port=port)
+    if debug_mode:
+        app.run(debug=True, host='0.0.0.0', port=port)
+    else:
+        # Same gunicorn handoff as flask_app.py. The pool raises rather
+        # than waits when it runs dry, so each worker takes no more
+        # concurrent requests than it has connections.
+        workers = os.getenv('FLASK_WORKERS', '2')
+        worker_connections = os.getenv('FLASK_WORKER_CONNECTIONS', os.getenv('POSTGRES_POOL_MAX', '25'))
+        module = os.path.splitext(os.path.basename(__file__))[0]
+        os.execv(sys.executable, [
+            sys.executable, '-m', 'gunicorn', '-k', 'gevent', '-w', workers,
+            f'--worker-connections={worker_connections}',
+            f'--bind=0.0.0.0:{port}',
+            f'--chdir={os.path.dirname(os.path.abspath(__file__))}',
+            f'{module}:app'
+        ])
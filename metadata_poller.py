@@ -9,26 +9,59 @@ import sqlite3
 import time
 import requests
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 
 METADATA_URL = 'https://d3d4yli4hf5bmh.cloudfront.net/metadatav2.json'
 COVER_ART_URL = 'https://d3d4yli4hf5bmh.cloudfront.net/cover.jpg'
 DATABASE = os.getenv('FLASK_DATABASE_PATH', './flask_database.sqlite')
 POLL_INTERVAL = 15  # Check every 15 seconds
 
+# One keep-alive session for every poll, so the TCP/TLS connection to the
+# CDN is reused instead of set up again every POLL_INTERVAL
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+# Validators from the last metadata response, sent back so an unchanged
+# document comes back as an empty 304
+_validators = {}
+
+# (artist, title) of the last track written; polls land several times per
+# song, and repeats of the same track need no database work
+_last_track = (None, None)
+
+# One connection is kept open for the life of the poller rather than
+# reopened every poll; it is dropped and reopened if a poll fails
+_db = None
+
 def get_db():
     """Connect to database"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _db
+    if _db is None:
+        # Autocommit mode: each poll takes the write lock explicitly with
+        # BEGIN IMMEDIATE. busy_timeout rides out the Flask app's writes.
+        _db = sqlite3.connect(DATABASE, isolation_level=None)
+        _db.execute('PRAGMA busy_timeout = 5000')
+        _db.execute('PRAGMA synchronous = NORMAL')
+    return _db
+
+def close_db():
+    """Close the shared connection so the next poll reconnects"""
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
 
 def update_tracks(metadata):
     """Update database with current and previous tracks"""
-    db = get_db()
-    cursor = db.cursor()
+    global _last_track
 
     # Current track
     artist = metadata.get('artist', 'Unknown Artist')
     title = metadata.get('title', 'Unknown Track')
+    if (artist, title) == _last_track:
+        return
+
+    db = get_db()
     album = metadata.get('album', '')
     year = metadata.get('date', '')
 
@@ -37,63 +70,61 @@ def update_tracks(metadata):
     if album:
         print(f"   Album: {album} ({year})")
 
-    # Mark all tracks as not current
-    cursor.execute('UPDATE tracks SET is_current = 0')
+    previous_tracks = []
+    for i in range(1, 6):
+        prev_artist = metadata.get(f'prev_artist_{i}')
+        prev_title = metadata.get(f'prev_title_{i}')
 
-    # Check if current track exists
-    existing = cursor.execute('''
-        SELECT id FROM tracks
-        WHERE artist = ? AND title = ?
-    ''', (artist, title)).fetchone()
+        if prev_artist and prev_title:
+            previous_tracks.append((prev_artist, prev_title))
 
-    # Use live cover art URL with cache-busting timestamp
-    cover_url = f"{COVER_ART_URL}?t={int(time.time())}"
+    with db:
+        db.execute('BEGIN IMMEDIATE')
 
-    if existing:
-        cursor.execute('''
-            UPDATE tracks
-            SET is_current = 1, played_at = CURRENT_TIMESTAMP,
-                album = ?, year = ?, album_art_url = ?
-            WHERE id = ?
-        ''', (album, year, cover_url, existing['id']))
-    else:
-        cursor.execute('''
+        # Only the previous current track needs clearing
+        db.execute('UPDATE tracks SET is_current = 0 WHERE is_current = 1')
+
+        # Insert the current track, or mark a known one current and refresh
+        # its metadata, in one statement (unique index on artist, title).
+        # The cover URL is stored as-is; the player versions it by played_at.
+        db.execute('''
             INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
             VALUES (?, ?, ?, ?, 1, ?)
-        ''', (artist, title, album, year, cover_url))
-
-    # Update previous tracks
-    for i in range(1, 6):
-        prev_artist = metadata.get(f'prev_artist_{i}')
-        prev_title = metadata.get(f'prev_title_{i}')
+            ON CONFLICT (artist, title) DO UPDATE
+            SET is_current = 1, played_at = CURRENT_TIMESTAMP,
+                album = excluded.album, year = excluded.year,
+                album_art_url = excluded.album_art_url
+        ''', (artist, title, album, year, COVER_ART_URL))
 
-        if prev_artist and prev_title:
-            # Check if previous track exists
-            prev_exists = cursor.execute('''
-                SELECT id FROM tracks
-                WHERE artist = ? AND title = ?
-            ''', (prev_artist, prev_title)).fetchone()
-
-            if not prev_exists:
-                # Add to database as a previously played track (no album art for old tracks)
-                cursor.execute('''
-                    INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-                    VALUES (?, ?, ?, ?, 0, ?)
-                ''', (prev_artist, prev_title, '', None, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Previous'))
-
-    db.commit()
-    db.close()
+        # Add previous tracks not yet in the database (no album art for old
+        # tracks); the unique (artist, title) index skips ones already there
+        db.executemany('''
+            INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
+            VALUES (?, ?, '', NULL, 0, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Previous')
+            ON CONFLICT (artist, title) DO NOTHING
+        ''', previous_tracks)
 
+    # Only remembered once committed, so a failed write is retried next poll
+    _last_track = (artist, title)
     print(f"✓ Database updated")
 
 def poll_metadata():
     """Fetch and process metadata"""
     try:
-        response = requests.get(METADATA_URL, timeout=5)
+        response = _session.get(METADATA_URL, headers=_validators, timeout=5)
+        if response.status_code == 304:
+            return True
         response.raise_for_status()
         metadata = response.json()
 
         update_tracks(metadata)
+
+        # Only remembered once written, so a failed write is retried
+        _validators.clear()
+        if 'ETag' in response.headers:
+            _validators['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            _validators['If-Modified-Since'] = response.headers['Last-Modified']
         return True
 
     except requests.RequestException as e:
@@ -101,6 +132,7 @@ def poll_metadata():
         return False
     except Exception as e:
         print(f"❌ Error processing metadata: {e}")
+        close_db()
         return False
 
 def main():
@@ -5,15 +5,47 @@ Fetches real track information from the stream's metadata API
 """
 
 import os
+import orjson
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import time
 import requests
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 
 METADATA_URL = 'https://d3d4yli4hf5bmh.cloudfront.net/metadatav2.json'
 COVER_ART_URL = 'https://d3d4yli4hf5bmh.cloudfront.net/cover.jpg'
-POLL_INTERVAL = 15  # Check every 15 seconds
+POLL_INTERVAL = 15  # Check every 15 seconds to start with
+# The interval adapts to the track: it doubles, up to the maximum, while
+# the metadata stays the same and drops to the minimum when it changes
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 60
+
+# One keep-alive session for every poll, so the TCP/TLS connection to the
+# CDN is reused instead of set up again every POLL_INTERVAL
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+# Validators from the last metadata response that made it into the
+# database, sent back so an unchanged document comes back as an empty 304
+_validators = {}
+
+# Fingerprint of the last metadata written; polls land several times per
+# song, and a document with the same tracks in it needs no database work
+_last_fingerprint = None
+
+# Raw body of the last metadata document handled; a byte-identical one is
+# not even parsed
+_last_body = None
+
+def metadata_fingerprint(metadata):
+    """The parts of the metadata that update_tracks() writes"""
+    return (
+        metadata.get('artist'), metadata.get('title'),
+        metadata.get('album'), metadata.get('date'),
+        *(metadata.get(f'prev_{field}_{i}') for i in range(1, 6) for field in ('artist', 'title'))
+    )
 
 # PostgreSQL connection configuration
 POSTGRES_CONFIG = {
@@ -24,20 +56,77 @@ POSTGRES_CONFIG = {
     'password': os.getenv('POSTGRES_PASSWORD', 'radiocalico')
 }
 
+# The poll's fixed statements are prepared server-side once per pooled
+# connection, so PostgreSQL skips parsing and planning them on every write
+PREPARED_STATEMENTS = {
+    # Only a different previous current track needs clearing; the partial
+    # index on is_current finds it without touching the rest
+    'clear_current': '''
+        UPDATE tracks SET is_current = FALSE
+        WHERE is_current AND NOT (artist = $1 AND title = $2)
+    ''',
+    # Insert the current track, or mark a known one current and refresh
+    # its metadata, in one statement (unique index on artist, title)
+    'upsert_track': '''
+        INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
+        VALUES ($1, $2, $3, $4, TRUE, $5)
+        ON CONFLICT (artist, title) DO UPDATE
+        SET is_current = TRUE, played_at = CURRENT_TIMESTAMP,
+            album = EXCLUDED.album, year = EXCLUDED.year,
+            album_art_url = EXCLUDED.album_art_url
+    ''',
+}
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether PREPARED_STATEMENTS exist on it"""
+    prepared = False
+
+# Connections are opened once and reused across polls instead of paying
+# the connect and authentication handshake every 15 seconds
+_pool = None
+
+def get_pool():
+    """Create the connection pool on first use"""
+    global _pool
+    if _pool is None:
+        try:
+            _pool = ThreadedConnectionPool(
+                1, 4,
+                connection_factory=PooledConnection,
+                cursor_factory=RealDictCursor,
+                **POSTGRES_CONFIG
+            )
+        except psycopg2.Error as e:
+            raise Exception(f"Database connection failed: {e}")
+    return _pool
+
 def get_db():
-    """Connect to PostgreSQL database"""
+    """Check a connection out of the pool, preparing it on first use"""
+    conn = get_pool().getconn()
+    if not conn.prepared:
+        # Prepared statements live as long as the session
+        try:
+            with conn.cursor() as cursor:
+                for name, query in PREPARED_STATEMENTS.items():
+                    cursor.execute(f'PREPARE {name} AS {query}')
+            conn.commit()
+        except psycopg2.Error:
+            put_db(conn)
+            raise
+        conn.prepared = True
+    return conn
+
+def put_db(conn):
+    """Return a connection to the pool, rolling back anything left open"""
     try:
-        conn = psycopg2.connect(**POSTGRES_CONFIG)
-        conn.cursor_factory = RealDictCursor
-        return conn
-    except psycopg2.Error as e:
-        raise Exception(f"Database connection failed: {e}")
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    get_pool().putconn(conn, close=bool(conn.closed))
 
 def update_tracks(metadata):
     """Update database with current and previous tracks"""
-    db = get_db()
-    cursor = db.cursor()
-
     # Current track
     artist = metadata.get('artist', 'Unknown Artist')
     title = metadata.get('title', 'Unknown Track')
@@ -49,66 +138,68 @@ def update_tracks(metadata):
     if album:
         print(f"   Album: {album} ({year})")
 
-    # Mark all tracks as not current
-    cursor.execute('UPDATE tracks SET is_current = FALSE')
-
-    # Check if current track exists
-    cursor.execute('''
-        SELECT id FROM tracks
-        WHERE artist = %s AND title = %s
-    ''', (artist, title))
-    existing = cursor.fetchone()
-
-    # Use live cover art URL with cache-busting timestamp
-    cover_url = f"{COVER_ART_URL}?t={int(time.time())}"
-
-    if existing:
-        cursor.execute('''
-            UPDATE tracks
-            SET is_current = TRUE, played_at = CURRENT_TIMESTAMP,
-                album = %s, year = %s, album_art_url = %s
-            WHERE id = %s
-        ''', (album, year, cover_url, existing['id']))
-    else:
-        cursor.execute('''
-            INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-            VALUES (%s, %s, %s, %s, TRUE, %s)
-        ''', (artist, title, album, year, cover_url))
-
-    # Update previous tracks
+    # Live cover art URL, stored as-is; the player versions it by played_at
+    cover_url = COVER_ART_URL
+
+    previous_tracks = []
     for i in range(1, 6):
         prev_artist = metadata.get(f'prev_artist_{i}')
         prev_title = metadata.get(f'prev_title_{i}')
 
         if prev_artist and prev_title:
-            # Check if previous track exists
-            cursor.execute('''
-                SELECT id FROM tracks
-                WHERE artist = %s AND title = %s
-            ''', (prev_artist, prev_title))
-            prev_exists = cursor.fetchone()
-
-            if not prev_exists:
-                # Add to database as a previously played track (no album art for old tracks)
-                cursor.execute('''
+            previous_tracks.append((prev_artist, prev_title))
+
+    db = get_db()
+    try:
+        # Every statement of the poll rides on one transaction: committed
+        # when the block exits, rolled back if anything in it raises
+        with db, db.cursor() as cursor:
+            cursor.execute('EXECUTE clear_current (%s, %s)', (artist, title))
+            cursor.execute('EXECUTE upsert_track (%s, %s, %s, %s, %s)',
+                           (artist, title, album, year, cover_url))
+
+            # Add previous tracks not yet in the database (no album art for old
+            # tracks) as one multi-row INSERT; ones already there are skipped
+            if previous_tracks:
+                execute_values(cursor, '''
                     INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-                    VALUES (%s, %s, %s, %s, FALSE, %s)
-                ''', (prev_artist, prev_title, '', None, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Previous'))
+                    VALUES %s
+                    ON CONFLICT (artist, title) DO NOTHING
+                ''', previous_tracks,
+                    template="(%s, %s, '', NULL, FALSE, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Previous')")
 
-    db.commit()
-    cursor.close()
-    db.close()
+            # Rebuild the precomputed recently played list (see flask_app_postgres)
+            cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY recent_tracks')
+    finally:
+        put_db(db)
 
     print(f"✓ Database updated")
 
 def poll_metadata():
     """Fetch and process metadata"""
+    global _last_fingerprint, _last_body
     try:
-        response = requests.get(METADATA_URL, timeout=5)
+        response = _session.get(METADATA_URL, headers=_validators, timeout=5)
+        if response.status_code == 304:
+            return True
         response.raise_for_status()
-        metadata = response.json()
-
-        update_tracks(metadata)
+        body = response.content
+        if body == _last_body:
+            return True
+        metadata = orjson.loads(body)
+
+        fingerprint = metadata_fingerprint(metadata)
+        if fingerprint != _last_fingerprint:
+            update_tracks(metadata)
+            _last_fingerprint = fingerprint
+        _last_body = body
+
+        # Only remembered once written, so a failed write is retried
+        _validators.clear()
+        if 'ETag' in response.headers:
+            _validators['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            _validators['If-Modified-Since'] = response.headers['Last-Modified']
         return True
 
     except requests.RequestException as e:
@@ -124,7 +215,7 @@ def main():
     print("Radio Calico - Live Metadata Poller (PostgreSQL)")
     print("=" * 70)
     print(f"Metadata URL: {METADATA_URL}")
-    print(f"Poll interval: {POLL_INTERVAL} seconds")
+    print(f"Poll interval: {MIN_POLL_INTERVAL}-{MAX_POLL_INTERVAL} seconds (adaptive, starting at {POLL_INTERVAL})")
     print(f"Database: PostgreSQL at {POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}")
     print("Press Ctrl+C to stop")
     print("=" * 70)
@@ -134,13 +225,19 @@ def main():
 
     consecutive_errors = 0
     max_errors = 5
+    interval = POLL_INTERVAL
 
     try:
         while True:
-            time.sleep(POLL_INTERVAL)
+            time.sleep(interval)
 
+            last_fingerprint = _last_fingerprint
             if poll_metadata():
                 consecutive_errors = 0
+                if _last_fingerprint != last_fingerprint:
+                    interval = MIN_POLL_INTERVAL
+                else:
+                    interval = min(interval * 2, MAX_POLL_INTERVAL)
             else:
                 consecutive_errors += 1
                 if consecutive_errors >= max_errors:
@@ -272,6 +272,15 @@ function resetElapsedTime() {
     stopElapsedTimer();
 }
 
+// Album art URL for a track. The server stores the cover URL as-is; the
+// version changes only when a new track starts, so the image is cached
+// for as long as the track plays.
+function albumArtSrc(track) {
+    if (!track.played_at) return track.album_art_url;
+    const separator = track.album_art_url.includes('?') ? '&' : '?';
+    return `${track.album_art_url}${separator}v=${encodeURIComponent(track.played_at)}`;
+}
+
 // Fetch now playing track
 async function fetchNowPlaying() {
     try {
@@ -286,7 +295,7 @@ async function fetchNowPlaying() {
             trackTitle.textContent = track.title;
             albumName.textContent = track.album + (track.year ? ` (${track.year})` : '');
             if (track.album_art_url) {
-                albumArt.src = track.album_art_url;
+                albumArt.src = albumArtSrc(track);
             }
 
             // Update rating counts
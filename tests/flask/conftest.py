@@ -2,11 +2,11 @@
 Pytest configuration and fixtures for Flask backend testing
 """
 
+import orjson
 import pytest
 import sqlite3
-import tempfile
-import os
 import sys
+import uuid
 from pathlib import Path
 
 # Add project root to path for imports
@@ -14,95 +14,216 @@ project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'slow: request-by-request variants of batched tests; deselect with -m "not slow"'
+    )
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify() backed by orjson, as in flask_app"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+@pytest.fixture(scope='session')
+def db_uri():
+    """URI of the shared-cache in-memory database the test app connects to
+
+    The name is fixed for the session, but the database itself only lives
+    while the db fixture's connection is open, so each test starts from
+    whatever db copies into it.
+    """
+    return f'file:radiocalico_test_{uuid.uuid4().hex}?mode=memory&cache=shared'
+
+
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS tracks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        artist TEXT NOT NULL,
+        title TEXT NOT NULL,
+        album TEXT,
+        year INTEGER,
+        album_art_url TEXT,
+        played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_current BOOLEAN DEFAULT 0,
+        thumbs_up INTEGER NOT NULL DEFAULT 0,
+        thumbs_down INTEGER NOT NULL DEFAULT 0
+    );
+
+    -- Same indexes as flask_app.init_db(), so queries plan as in production
+    CREATE INDEX IF NOT EXISTS idx_tracks_current_played ON tracks (is_current, played_at DESC);
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_tracks_artist_title ON tracks (artist, title);
+
+    CREATE TABLE IF NOT EXISTS ratings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        track_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        rating_type INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (track_id) REFERENCES tracks (id),
+        UNIQUE (track_id, user_id)
+    );
+
+    -- No further ratings index, as in flask_app: (track_id, user_id)
+    -- lookups use the UNIQUE constraint's index, and counts live on tracks
+'''
+
+# SQL for the rating routes, kept as stable strings like flask_app's SQL_*
+# constants so each connection's statement cache sees one text per query
+SQL_USER_RATING = '''
+    SELECT rating_type FROM ratings
+    WHERE track_id = ? AND user_id = ?
+'''
+
+SQL_INSERT_RATING = '''
+    INSERT INTO ratings (track_id, user_id, rating_type)
+    VALUES (?, ?, ?)
+'''
+
+# As in flask_app, every new rating bumps its track's counter in the same
+# transaction, and the new totals are read back from the track row
+SQL_BUMP_TRACK_COUNTS = '''
+    UPDATE tracks
+    SET thumbs_up = thumbs_up + ?, thumbs_down = thumbs_down + ?
+    WHERE id = ?
+    RETURNING thumbs_up, thumbs_down
+'''
+
+# update-track's statements, word for word from flask_app
+SQL_CLEAR_CURRENT = 'UPDATE tracks SET is_current = 0 WHERE is_current = 1'
+
+SQL_UPSERT_CURRENT = '''
+    INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
+    VALUES (?, ?, ?, ?, 1, ?)
+    ON CONFLICT (artist, title) DO UPDATE
+    SET is_current = 1, played_at = CURRENT_TIMESTAMP
+'''
+
+
+def insert_ratings(db, rows):
+    """Insert (track_id, user_id, rating_type) rows in one transaction
+
+    Bumps each track's counters as the rate route does, so fixtures that
+    write ratings directly leave the database as the API would.
+    """
+    counts = {}
+    for track_id, _, rating_type in rows:
+        up, down = counts.get(track_id, (0, 0))
+        counts[track_id] = (up + (rating_type == 1), down + (rating_type == -1))
+
+    db.execute('BEGIN')
+    db.executemany(SQL_INSERT_RATING, rows)
+    for track_id, (up, down) in counts.items():
+        db.execute(SQL_BUMP_TRACK_COUNTS, (up, down, track_id)).fetchone()
+    db.commit()
 
 
-@pytest.fixture
-def db_path():
-    """Create a temporary database path for testing"""
-    fd, path = tempfile.mkstemp(suffix='.sqlite')
-    os.close(fd)
-    yield path
-    # Cleanup
-    try:
-        os.unlink(path)
-    except:
-        pass
+@pytest.fixture(scope='session')
+def template_db():
+    """Schema-only database built once per session and copied into each test"""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(SCHEMA_SQL)
+    yield conn
+    conn.close()
 
 
 @pytest.fixture
-def db(db_path):
-    """Create an in-memory database for testing"""
-    conn = sqlite3.connect(db_path)
+def db(db_uri, template_db):
+    """Create an in-memory database for testing
+
+    The schema is copied page by page from template_db rather than built
+    again. This connection is opened first and closed last, which keeps the
+    shared in-memory database alive for exactly the length of the test.
+
+    The connection runs in autocommit mode: sqlite3 opens no implicit
+    transactions, so a test that needs one issues BEGIN itself.
+    """
+    conn = sqlite3.connect(db_uri, uri=True, isolation_level=None)
+    # The journal of an in-memory database is already in memory; keep
+    # sorter and temp-index spill there too
+    conn.execute('PRAGMA temp_store = MEMORY')
+    # SQLite leaves REFERENCES unenforced unless asked, per connection
+    conn.execute('PRAGMA foreign_keys = ON')
+    template_db.backup(conn)
     conn.row_factory = sqlite3.Row
 
-    # Create tables
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            email TEXT NOT NULL UNIQUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            user_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS tracks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            artist TEXT NOT NULL,
-            title TEXT NOT NULL,
-            album TEXT,
-            year INTEGER,
-            album_art_url TEXT,
-            played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_current BOOLEAN DEFAULT 0
-        )
-    ''')
-
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS ratings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            track_id INTEGER NOT NULL,
-            user_id TEXT NOT NULL,
-            rating_type INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (track_id) REFERENCES tracks (id),
-            UNIQUE (track_id, user_id)
-        )
-    ''')
+    yield conn
 
-    conn.commit()
+    conn.close()
 
-    yield conn
 
+@pytest.fixture(scope='session')
+def seeded_template(template_db):
+    """Copy of template_db with a canonical set of tracks, built once"""
+    conn = sqlite3.connect(':memory:')
+    template_db.backup(conn)
+    conn.executemany(
+        'INSERT INTO tracks (artist, title, is_current) VALUES (?, ?, ?)',
+        [(f'Artist {i}', f'Title {i}', False) for i in range(5)]
+    )
+    conn.commit()
+    yield conn
     conn.close()
 
 
 @pytest.fixture
-def app(db, db_path):
-    """Create a Flask app for testing"""
+def seeded_db(db, seeded_template):
+    """The test database pre-filled with seeded_template's tracks"""
+    seeded_template.backup(db)
+    return db
+
+
+@pytest.fixture(autouse=True)
+def _db_reset(db):
+    """Give every test, including client-only ones, a fresh schema copy"""
+
+
+@pytest.fixture(scope='session')
+def app(db_uri):
+    """Create a Flask app for testing, once per session
+
+    Routes are registered a single time; per-test isolation comes from
+    _db_reset recreating the database the app connects to.
+    """
     from flask import Flask, jsonify, g, request
     from flask_cors import CORS
 
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     CORS(app)
-    app.config['DATABASE'] = db_path
+    app.config['DATABASE'] = db_uri
     app.config['TESTING'] = True
 
     def get_db():
         db_conn = getattr(g, '_database', None)
         if db_conn is None:
-            db_conn = g._database = sqlite3.connect(db_path)
+            db_conn = g._database = sqlite3.connect(db_uri, uri=True)
+            # As flask_app.CONNECTION_PRAGMAS does for every pooled connection
+            db_conn.execute('PRAGMA foreign_keys = ON')
             db_conn.row_factory = sqlite3.Row
         return db_conn
 
@@ -133,8 +254,10 @@ def app(db, db_path):
     def now_playing():
         try:
             database = get_db()
+            # Counters live on the track row, as in flask_app
             cursor = database.execute('''
-                SELECT id, artist, title, album, year, album_art_url
+                SELECT id, artist, title, album, year, album_art_url,
+                       thumbs_up, thumbs_down
                 FROM tracks
                 WHERE is_current = 1
                 LIMIT 1
@@ -142,21 +265,9 @@ def app(db, db_path):
             track = cursor.fetchone()
 
             if track:
-                track_dict = dict(track)
-                ratings_cursor = database.execute('''
-                    SELECT
-                        SUM(CASE WHEN rating_type = 1 THEN 1 ELSE 0 END) as thumbs_up,
-                        SUM(CASE WHEN rating_type = -1 THEN 1 ELSE 0 END) as thumbs_down
-                    FROM ratings
-                    WHERE track_id = ?
-                ''', (track_dict['id'],))
-                ratings = ratings_cursor.fetchone()
-                track_dict['thumbs_up'] = ratings['thumbs_up'] or 0
-                track_dict['thumbs_down'] = ratings['thumbs_down'] or 0
-
                 return jsonify({
                     'status': 'success',
-                    'data': track_dict
+                    'data': dict(track)
                 })
             else:
                 return jsonify({
@@ -229,10 +340,9 @@ def app(db, db_path):
                     'message': 'Track not found'
                 }), 404
 
-            existing_rating = database.execute('''
-                SELECT rating_type FROM ratings
-                WHERE track_id = ? AND user_id = ?
-            ''', (track_id, user_id)).fetchone()
+            existing_rating = database.execute(
+                SQL_USER_RATING, (track_id, user_id)
+            ).fetchone()
 
             if existing_rating:
                 return jsonify({
@@ -241,27 +351,20 @@ def app(db, db_path):
                     'existing_rating': existing_rating['rating_type']
                 }), 409
 
-            database.execute('''
-                INSERT INTO ratings (track_id, user_id, rating_type)
-                VALUES (?, ?, ?)
-            ''', (track_id, user_id, rating_type))
+            # sqlite3 opens one implicit transaction for both writes
+            database.execute(SQL_INSERT_RATING, (track_id, user_id, rating_type))
+            ratings = database.execute(
+                SQL_BUMP_TRACK_COUNTS,
+                (int(rating_type == 1), int(rating_type == -1), track_id)
+            ).fetchone()
             database.commit()
 
-            ratings_cursor = database.execute('''
-                SELECT
-                    SUM(CASE WHEN rating_type = 1 THEN 1 ELSE 0 END) as thumbs_up,
-                    SUM(CASE WHEN rating_type = -1 THEN 1 ELSE 0 END) as thumbs_down
-                FROM ratings
-                WHERE track_id = ?
-            ''', (track_id,))
-            ratings = ratings_cursor.fetchone()
-
             return jsonify({
                 'status': 'success',
                 'message': 'Rating submitted successfully',
                 'data': {
-                    'thumbs_up': ratings['thumbs_up'] or 0,
-                    'thumbs_down': ratings['thumbs_down'] or 0
+                    'thumbs_up': ratings['thumbs_up'],
+                    'thumbs_down': ratings['thumbs_down']
                 }
             })
         except Exception as e:
@@ -284,10 +387,9 @@ def app(db, db_path):
 
             database = get_db()
 
-            existing_rating = database.execute('''
-                SELECT rating_type FROM ratings
-                WHERE track_id = ? AND user_id = ?
-            ''', (track_id, user_id)).fetchone()
+            existing_rating = database.execute(
+                SQL_USER_RATING, (track_id, user_id)
+            ).fetchone()
 
             if existing_rating:
                 return jsonify({
@@ -322,27 +424,11 @@ def app(db, db_path):
 
             database = get_db()
 
-            database.execute('UPDATE tracks SET is_current = 0')
-
-            existing = database.execute('''
-                SELECT id FROM tracks
-                WHERE artist = ? AND title = ?
-                ORDER BY played_at DESC LIMIT 1
-            ''', (artist, title)).fetchone()
-
-            if existing:
-                database.execute('''
-                    UPDATE tracks
-                    SET is_current = 1, played_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (existing['id'],))
-            else:
-                database.execute('''
-                    INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-                    VALUES (?, ?, ?, ?, 1, ?)
-                ''', (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
-
-            database.commit()
+            # One write transaction, as flask_app's begin_immediate() opens
+            with database:
+                database.execute('BEGIN IMMEDIATE')
+                database.execute(SQL_CLEAR_CURRENT)
+                database.execute(SQL_UPSERT_CURRENT, (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
 
             return jsonify({
                 'status': 'success',
@@ -361,12 +447,26 @@ def app(db, db_path):
     yield app
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def client(app):
-    """Create a test client for the app"""
+    """Create a test client for the app, shared by the whole session"""
     return app.test_client()
 
 
+@pytest.fixture
+def call_view(app):
+    """Run the view matched by a path directly, without the WSGI round trip
+
+    Takes test_request_context() arguments and returns the view's response.
+    before/after_request hooks such as CORS are skipped.
+    """
+    def call_view(path, **kwargs):
+        with app.test_request_context(path, **kwargs):
+            return app.make_response(app.dispatch_request())
+
+    return call_view
+
+
 @pytest.fixture
 def runner(app):
     """Create a test runner for the app"""
@@ -375,18 +475,12 @@ def runner(app):
 
 @pytest.fixture
 def track(db):
-    """Create a test track"""
-    cursor = db.cursor()
-    cursor.execute("""
+    """Create a test track, marked current"""
+    track_id = db.execute("""
         INSERT INTO tracks (artist, title, album, year, is_current)
         VALUES (?, ?, ?, ?, ?)
-    """, ('Test Artist', 'Test Song', 'Test Album', 2024, True))
-    db.commit()
-    track_id = cursor.lastrowid
-
-    # Return track data
-    track = db.execute('SELECT * FROM tracks WHERE id = ?', (track_id,)).fetchone()
-    return track
+    """, ('Test Artist', 'Test Song', 'Test Album', 2024, True)).lastrowid
+    return db.execute('SELECT * FROM tracks WHERE id = ?', (track_id,)).fetchone()
 
 
 @pytest.fixture
@@ -398,30 +492,25 @@ def tracks(db):
         ('Artist 3', 'Track 3', 'Album 3', 2022, False),
     ]
 
-    track_ids = []
-    for artist, title, album, year, is_current in track_data:
-        cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO tracks (artist, title, album, year, is_current)
-            VALUES (?, ?, ?, ?, ?)
-        """, (artist, title, album, year, is_current))
-        db.commit()
-        track_ids.append(cursor.lastrowid)
+    db.execute('BEGIN')
+    db.executemany("""
+        INSERT INTO tracks (artist, title, album, year, is_current)
+        VALUES (?, ?, ?, ?, ?)
+    """, track_data)
+    db.commit()
 
-    return track_ids
+    # executemany() leaves lastrowid unset; the rows got consecutive ids
+    # ending at the connection's last inserted rowid
+    last_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return list(range(last_id - len(track_data) + 1, last_id + 1))
 
 
 @pytest.fixture
 def rating(db, track):
     """Create a test rating"""
-    cursor = db.cursor()
-    cursor.execute("""
-        INSERT INTO ratings (track_id, user_id, rating_type)
-        VALUES (?, ?, ?)
-    """, (track['id'], 'user_test_123', 1))
-    db.commit()
+    insert_ratings(db, [(track['id'], 'user_test_123', 1)])
 
-    rating = db.execute('SELECT * FROM ratings WHERE id = ?', (cursor.lastrowid,)).fetchone()
+    rating = db.execute('SELECT * FROM ratings WHERE id = last_insert_rowid()').fetchone()
     return rating
 
 
@@ -435,24 +524,54 @@ def ratings(db, tracks):
         (tracks[1], 'user_4', 1),
     ]
 
-    for track_id, user_id, rating_type in rating_data:
-        cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO ratings (track_id, user_id, rating_type)
-            VALUES (?, ?, ?)
-        """, (track_id, user_id, rating_type))
-        db.commit()
+    insert_ratings(db, rating_data)
 
     return rating_data
 
 
 @pytest.fixture
+def bulk_rate(db):
+    """Insert (user_id, rating_type) pairs for a track in one transaction
+
+    The track's counters are bumped to match. For tests that only need
+    ratings to exist; submission itself is covered through the rate
+    endpoint.
+    """
+    def bulk_rate(track_id, items):
+        insert_ratings(db, [(track_id, user_id, rating_type) for user_id, rating_type in items])
+
+    return bulk_rate
+
+
+@pytest.fixture
+def count_ratings(db):
+    """Return a track's (thumbs_up, thumbs_down) straight from the database"""
+    def count_ratings(track_id):
+        return tuple(db.execute("""
+            SELECT COUNT(*) FILTER (WHERE rating_type = 1),
+                   COUNT(*) FILTER (WHERE rating_type = -1)
+            FROM ratings WHERE track_id = ?
+        """, (track_id,)).fetchone())
+
+    return count_ratings
+
+
+USER_IDS = (
+    'user_test_1',
+    'user_test_2',
+    'user_1234567890_abc123',
+    'user_with-dash',
+    'user.with.dots'
+)
+
+
+@pytest.fixture(scope='session')
 def user_ids():
     """Provide test user IDs"""
-    return [
-        'user_test_1',
-        'user_test_2',
-        'user_1234567890_abc123',
-        'user_with-dash',
-        'user.with.dots'
-    ]
+    return USER_IDS
+
+
+@pytest.fixture(params=USER_IDS)
+def user_id(request):
+    """Each test user ID in turn, one test case per ID"""
+    return request.param
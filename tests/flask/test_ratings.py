@@ -6,6 +6,16 @@ Tests rating endpoints, validation, and database operations
 import pytest
 import sqlite3
 
+LONG_USER_ID = 'user_' + 'x' * 1000
+
+
+def rate_and_get_status(call_view, track_id, user_id, rating_type):
+    """Submit a rating, then return the user's rating status for the track"""
+    call_view(f'/api/tracks/{track_id}/rate', method='POST',
+              json={'user_id': user_id, 'rating_type': rating_type})
+    return call_view(f'/api/tracks/{track_id}/rating-status', method='POST',
+                     json={'user_id': user_id})
+
 
 class TestRatingSubmission:
     """Tests for POST /api/tracks/<track_id>/rate endpoint"""
@@ -42,18 +52,16 @@ class TestRatingSubmission:
         assert data['status'] == 'error'
         assert 'user_id' in data['message']
 
-    def test_invalid_rating_type_returns_400(self, client, track):
+    @pytest.mark.parametrize('invalid_type', [0, 2, 5, -2, 100, 'up', 'down'])
+    def test_invalid_rating_type_returns_400(self, client, track, invalid_type):
         """Test that invalid rating_type returns 400 error"""
-        invalid_types = [0, 2, 5, -2, 100, 'up', 'down']
-
-        for invalid_type in invalid_types:
-            response = client.post(f'/api/tracks/{track["id"]}/rate',
-                                  json={'user_id': 'user_test', 'rating_type': invalid_type})
+        response = client.post(f'/api/tracks/{track["id"]}/rate',
+                              json={'user_id': 'user_test', 'rating_type': invalid_type})
 
-            assert response.status_code == 400
-            data = response.get_json()
-            assert data['status'] == 'error'
-            assert 'rating_type' in data['message']
+        assert response.status_code == 400
+        data = response.get_json()
+        assert data['status'] == 'error'
+        assert 'rating_type' in data['message']
 
     def test_track_not_found_returns_404(self, client):
         """Test rating non-existent track returns 404"""
@@ -65,10 +73,11 @@ class TestRatingSubmission:
         assert data['status'] == 'error'
         assert 'not found' in data['message']
 
-    def test_duplicate_rating_returns_409(self, client, rating):
-        """Test that duplicate rating returns 409 conflict"""
+    @pytest.mark.parametrize('new_type', [1, -1], ids=['same_type', 'different_type'])
+    def test_duplicate_rating_returns_409(self, client, rating, new_type):
+        """Test that a second rating of either type returns 409 conflict"""
         response = client.post(f'/api/tracks/{rating["track_id"]}/rate',
-                              json={'user_id': rating['user_id'], 'rating_type': 1})
+                              json={'user_id': rating['user_id'], 'rating_type': new_type})
 
         assert response.status_code == 409
         data = response.get_json()
@@ -76,16 +85,7 @@ class TestRatingSubmission:
         assert 'already rated' in data['message']
         assert data['existing_rating'] == rating['rating_type']
 
-    def test_duplicate_rating_different_type_returns_409(self, client, rating):
-        """Test that rating with different type also returns 409"""
-        response = client.post(f'/api/tracks/{rating["track_id"]}/rate',
-                              json={'user_id': rating['user_id'], 'rating_type': -1})
-
-        assert response.status_code == 409
-        data = response.get_json()
-        assert data['status'] == 'error'
-
-    def test_rating_counts_update_correctly(self, client, track):
+    def test_rating_counts_update_correctly(self, client, db, track, count_ratings):
         """Test that rating counts are calculated correctly"""
         track_id = track['id']
 
@@ -103,12 +103,24 @@ class TestRatingSubmission:
                                   json={'user_id': user_id, 'rating_type': rating_type})
             assert response.status_code == 200
 
-        # Check final counts
-        response = client.get('/api/now-playing')
-        data = response.get_json()
+        # Check final counts, in the response and in the track's counters
+        assert count_ratings(track_id) == (3, 2)
+        assert response.get_json()['data'] == {'thumbs_up': 3, 'thumbs_down': 2}
+        counters = db.execute(
+            'SELECT thumbs_up, thumbs_down FROM tracks WHERE id = ?', (track_id,)
+        ).fetchone()
+        assert tuple(counters) == (3, 2)
+
+    def test_duplicate_rating_leaves_counters(self, client, db, rating):
+        """Test that a rejected repeat rating does not bump the track's counters"""
+        response = client.post(f'/api/tracks/{rating["track_id"]}/rate',
+                              json={'user_id': rating['user_id'], 'rating_type': -1})
+        assert response.status_code == 409
 
-        assert data['data']['thumbs_up'] == 3
-        assert data['data']['thumbs_down'] == 2
+        counters = db.execute(
+            'SELECT thumbs_up, thumbs_down FROM tracks WHERE id = ?', (rating['track_id'],)
+        ).fetchone()
+        assert tuple(counters) == (1, 0)
 
     def test_same_user_different_tracks(self, client, tracks):
         """Test that same user can rate different tracks"""
@@ -134,10 +146,10 @@ class TestRatingSubmission:
 class TestRatingStatus:
     """Tests for POST /api/tracks/<track_id>/rating-status endpoint"""
 
-    def test_check_rating_status_not_rated(self, client, track):
+    def test_check_rating_status_not_rated(self, call_view, track):
         """Test checking rating status when user hasn't rated"""
-        response = client.post(f'/api/tracks/{track["id"]}/rating-status',
-                              json={'user_id': 'user_never_rated'})
+        response = call_view(f'/api/tracks/{track["id"]}/rating-status', method='POST',
+                            json={'user_id': 'user_never_rated'})
 
         assert response.status_code == 200
         data = response.get_json()
@@ -145,10 +157,10 @@ class TestRatingStatus:
         assert data['data']['has_rated'] is False
         assert data['data']['rating_type'] is None
 
-    def test_check_rating_status_rated(self, client, rating):
+    def test_check_rating_status_rated(self, call_view, rating):
         """Test checking rating status when user has rated"""
-        response = client.post(f'/api/tracks/{rating["track_id"]}/rating-status',
-                              json={'user_id': rating['user_id']})
+        response = call_view(f'/api/tracks/{rating["track_id"]}/rating-status', method='POST',
+                            json={'user_id': rating['user_id']})
 
         assert response.status_code == 200
         data = response.get_json()
@@ -156,54 +168,36 @@ class TestRatingStatus:
         assert data['data']['has_rated'] is True
         assert data['data']['rating_type'] == rating['rating_type']
 
-    def test_rating_status_thumbs_up(self, client, track):
+    def test_rating_status_thumbs_up(self, call_view, track):
         """Test rating status for thumbs up"""
-        user_id = 'user_up_test'
-        track_id = track['id']
-
-        # First submit a thumbs up
-        client.post(f'/api/tracks/{track_id}/rate',
-                   json={'user_id': user_id, 'rating_type': 1})
-
-        # Check status
-        response = client.post(f'/api/tracks/{track_id}/rating-status',
-                              json={'user_id': user_id})
+        response = rate_and_get_status(call_view, track['id'], 'user_up_test', 1)
 
         data = response.get_json()
         assert data['data']['has_rated'] is True
         assert data['data']['rating_type'] == 1
 
-    def test_rating_status_thumbs_down(self, client, track):
+    def test_rating_status_thumbs_down(self, call_view, track):
         """Test rating status for thumbs down"""
-        user_id = 'user_down_test'
-        track_id = track['id']
-
-        # First submit a thumbs down
-        client.post(f'/api/tracks/{track_id}/rate',
-                   json={'user_id': user_id, 'rating_type': -1})
-
-        # Check status
-        response = client.post(f'/api/tracks/{track_id}/rating-status',
-                              json={'user_id': user_id})
+        response = rate_and_get_status(call_view, track['id'], 'user_down_test', -1)
 
         data = response.get_json()
         assert data['data']['has_rated'] is True
         assert data['data']['rating_type'] == -1
 
-    def test_rating_status_missing_user_id(self, client, track):
+    def test_rating_status_missing_user_id(self, call_view, track):
         """Test rating status without user_id returns error"""
-        response = client.post(f'/api/tracks/{track["id"]}/rating-status',
-                              json={})
+        response = call_view(f'/api/tracks/{track["id"]}/rating-status', method='POST',
+                            json={})
 
         assert response.status_code == 400
         data = response.get_json()
         assert data['status'] == 'error'
         assert 'user_id' in data['message']
 
-    def test_rating_status_nonexistent_track(self, client):
+    def test_rating_status_nonexistent_track(self, call_view):
         """Test rating status for non-existent track"""
-        response = client.post('/api/tracks/99999/rating-status',
-                              json={'user_id': 'user_test'})
+        response = call_view('/api/tracks/99999/rating-status', method='POST',
+                            json={'user_id': 'user_test'})
 
         assert response.status_code == 200
         data = response.get_json()
@@ -261,30 +255,26 @@ class TestRatingValidation:
 
         assert response.status_code == 400
 
-    def test_rating_type_accepts_only_1_or_minus_1(self, client, track):
+    # Note: True == 1 in Python, False == 0, None is falsy
+    @pytest.mark.parametrize('rating_type, expected_status', [
+        (1, 200), (-1, 200),
+        (0, 400), (2, 400), (-2, 400), (100, 400),
+        ('1', 400), ('-1', 400), (None, 400), (False, 400),
+    ])
+    def test_rating_type_accepts_only_1_or_minus_1(self, client, track,
+                                                   rating_type, expected_status):
         """Test that only 1 and -1 are valid rating types"""
-        valid_types = [1, -1]
-        # Note: True == 1 in Python, False == 0, None is falsy
-        invalid_types = [0, 2, -2, 100, '1', '-1', None, False]
-
-        for valid_type in valid_types:
-            response = client.post(f'/api/tracks/{track["id"]}/rate',
-                                  json={'user_id': f'user_{valid_type}', 'rating_type': valid_type})
-            assert response.status_code == 200
-
-        for invalid_type in invalid_types:
-            response = client.post(f'/api/tracks/{track["id"]}/rate',
-                                  json={'user_id': 'user_invalid', 'rating_type': invalid_type})
-            assert response.status_code == 400
+        response = client.post(f'/api/tracks/{track["id"]}/rate',
+                              json={'user_id': f'user_{rating_type}', 'rating_type': rating_type})
+        assert response.status_code == expected_status
 
-    def test_user_id_can_be_any_string(self, client, track, user_ids):
+    def test_user_id_can_be_any_string(self, client, track, user_id):
         """Test that various user ID formats are accepted"""
-        for user_id in user_ids:
-            response = client.post(f'/api/tracks/{track["id"]}/rate',
-                                  json={'user_id': user_id, 'rating_type': 1})
-            assert response.status_code == 200
-            data = response.get_json()
-            assert data['status'] == 'success'
+        response = client.post(f'/api/tracks/{track["id"]}/rate',
+                              json={'user_id': user_id, 'rating_type': 1})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['status'] == 'success'
 
     def test_empty_user_id_handled(self, client, track):
         """Test handling of empty string user_id"""
@@ -310,46 +300,32 @@ class TestRatingValidation:
 class TestRatingAggregation:
     """Tests for rating count aggregation"""
 
-    def test_thumbs_up_count(self, client, track):
+    def test_thumbs_up_count(self, client, track, bulk_rate):
         """Test thumbs up count aggregation"""
-        track_id = track['id']
-
         # Add 5 thumbs up
-        for i in range(5):
-            client.post(f'/api/tracks/{track_id}/rate',
-                       json={'user_id': f'user_up_{i}', 'rating_type': 1})
+        bulk_rate(track['id'], [(f'user_up_{i}', 1) for i in range(5)])
 
         response = client.get('/api/now-playing')
         data = response.get_json()
 
         assert data['data']['thumbs_up'] == 5
 
-    def test_thumbs_down_count(self, client, track):
+    def test_thumbs_down_count(self, client, track, bulk_rate):
         """Test thumbs down count aggregation"""
-        track_id = track['id']
-
         # Add 3 thumbs down
-        for i in range(3):
-            client.post(f'/api/tracks/{track_id}/rate',
-                       json={'user_id': f'user_down_{i}', 'rating_type': -1})
+        bulk_rate(track['id'], [(f'user_down_{i}', -1) for i in range(3)])
 
         response = client.get('/api/now-playing')
         data = response.get_json()
 
         assert data['data']['thumbs_down'] == 3
 
-    def test_mixed_ratings_count(self, client, track):
+    def test_mixed_ratings_count(self, client, track, bulk_rate):
         """Test mixed thumbs up and down counts"""
-        track_id = track['id']
-
         # Add mixed ratings
-        for i in range(7):
-            client.post(f'/api/tracks/{track_id}/rate',
-                       json={'user_id': f'user_mixed_up_{i}', 'rating_type': 1})
-
-        for i in range(4):
-            client.post(f'/api/tracks/{track_id}/rate',
-                       json={'user_id': f'user_mixed_down_{i}', 'rating_type': -1})
+        bulk_rate(track['id'],
+                  [(f'user_mixed_up_{i}', 1) for i in range(7)]
+                  + [(f'user_mixed_down_{i}', -1) for i in range(4)])
 
         response = client.get('/api/now-playing')
         data = response.get_json()
@@ -377,41 +353,35 @@ class TestRatingEdgeCases:
 
     def test_very_long_user_id(self, client, track):
         """Test handling of very long user IDs"""
-        long_user_id = 'user_' + 'x' * 1000
-
         response = client.post(f'/api/tracks/{track["id"]}/rate',
-                              json={'user_id': long_user_id, 'rating_type': 1})
+                              json={'user_id': LONG_USER_ID, 'rating_type': 1})
 
         # Should handle long strings
         assert response.status_code == 200
 
-    def test_special_characters_in_user_id(self, client, track):
+    @pytest.mark.parametrize('user_id', [
+        "user'with'quotes",
+        'user"with"quotes',
+        'user;with;semicolons',
+        'user\nwith\nnewlines',
+        'user\twith\ttabs'
+    ])
+    def test_special_characters_in_user_id(self, client, track, user_id):
         """Test handling of special characters in user ID"""
-        special_user_ids = [
-            "user'with'quotes",
-            'user"with"quotes',
-            'user;with;semicolons',
-            'user\nwith\nnewlines',
-            'user\twith\ttabs'
-        ]
-
-        for user_id in special_user_ids:
-            response = client.post(f'/api/tracks/{track["id"]}/rate',
-                                  json={'user_id': user_id, 'rating_type': 1})
-            # Should handle or reject gracefully
-            assert response.status_code in [200, 400]
-
-    def test_unicode_in_user_id(self, client, track):
+        response = client.post(f'/api/tracks/{track["id"]}/rate',
+                              json={'user_id': user_id, 'rating_type': 1})
+        # Should handle or reject gracefully
+        assert response.status_code in [200, 400]
+
+    @pytest.mark.parametrize('user_id', [
+        'user_中文',
+        'user_日本語',
+        'user_한국어',
+        'user_😀',
+        'user_👍'
+    ])
+    def test_unicode_in_user_id(self, client, track, user_id):
         """Test handling of unicode characters in user ID"""
-        unicode_user_ids = [
-            'user_中文',
-            'user_日本語',
-            'user_한국어',
-            'user_😀',
-            'user_👍'
-        ]
-
-        for user_id in unicode_user_ids:
-            response = client.post(f'/api/tracks/{track["id"]}/rate',
-                                  json={'user_id': user_id, 'rating_type': 1})
-            assert response.status_code == 200
+        response = client.post(f'/api/tracks/{track["id"]}/rate',
+                              json={'user_id': user_id, 'rating_type': 1})
+        assert response.status_code == 200
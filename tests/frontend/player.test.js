@@ -12,6 +12,13 @@ const fixtures = JSON.parse(
   readFileSync(join(__dirname, 'fixtures/tracks.json'), 'utf-8')
 );
 
+// player.js is a plain browser script without exports, so pull the pure
+// albumArtSrc() helper out of its source to test the real implementation
+const playerSource = readFileSync(join(__dirname, '../../public/player.js'), 'utf-8');
+const albumArtSrc = new Function(
+  `${playerSource.match(/^function albumArtSrc\(track\) \{[\s\S]*?^\}/m)[0]}\nreturn albumArtSrc;`
+)();
+
 // Mock DOM environment
 function setupMockDOM() {
   // Mock localStorage
@@ -516,3 +523,50 @@ describe('Rating Status Check', () => {
     });
   });
 });
+
+describe('Album Art', () => {
+  let mockElements;
+
+  beforeEach(() => {
+    const setup = setupMockDOM();
+    mockElements = setup.mockElements;
+    vi.clearAllMocks();
+  });
+
+  describe('albumArtSrc', () => {
+    it('should version a URL with a query string using &', () => {
+      const albumArt = mockElements.albumArt;
+      const track = { ...fixtures.currentTrack, played_at: '2024-01-01 12:00:00' };
+
+      albumArt.src = albumArtSrc(track);
+
+      expect(albumArt.src).toBe(
+        'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Shandi&v=2024-01-01%2012%3A00%3A00'
+      );
+    });
+
+    it('should version a URL without a query string using ?', () => {
+      const albumArt = mockElements.albumArt;
+      const track = {
+        album_art_url: 'https://example.com/covers/1.jpg',
+        played_at: '2024-01-01 12:00:00'
+      };
+
+      albumArt.src = albumArtSrc(track);
+
+      expect(albumArt.src).toBe('https://example.com/covers/1.jpg?v=2024-01-01%2012%3A00%3A00');
+    });
+
+    it('should leave the URL unchanged when played_at is null', () => {
+      const albumArt = mockElements.albumArt;
+      const track = {
+        album_art_url: 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Radio+Calico',
+        played_at: null
+      };
+
+      albumArt.src = albumArtSrc(track);
+
+      expect(albumArt.src).toBe(track.album_art_url);
+    });
+  });
+});
@@ -4,10 +4,10 @@ Radio Calico Track Rotator
 Automatically rotates through tracks to simulate live radio
 """
 
+import os
 import sqlite3
 import time
 import random
-from datetime import datetime
 
 # Sample track pool
 TRACK_POOL = [
@@ -28,65 +28,120 @@ TRACK_POOL = [
     ("Stevie Wonder", "Superstition", "Talking Book", 1972),
 ]
 
-DATABASE = './flask_database.sqlite'
+# (artist, title) of each pool entry, by index, for the repeat check
+_TRACK_KEYS = tuple((artist, title) for artist, title, _, _ in TRACK_POOL)
+
+DATABASE = os.getenv('FLASK_DATABASE_PATH', './flask_database.sqlite')
 ROTATION_INTERVAL = 180  # 3 minutes between tracks
+ALBUM_ART_URL = 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'
+
+# SQL for a rotation. sqlite3 caches prepared statements per connection by
+# exact text, and the connection lives for the whole run, so each of these
+# is parsed and planned once.
+SQL_GET_CURRENT = 'SELECT artist, title FROM tracks WHERE is_current = 1'
+
+# Only the previous current track needs clearing
+SQL_CLEAR_CURRENT = 'UPDATE tracks SET is_current = 0 WHERE is_current = 1'
+
+# Insert the track, or mark a known one current, in one statement; relies on
+# the unique (artist, title) index flask_app.init_db() creates
+SQL_UPSERT_CURRENT = '''
+    INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
+    VALUES (?, ?, ?, ?, 1, ?)
+    ON CONFLICT (artist, title) DO UPDATE
+    SET is_current = 1, played_at = CURRENT_TIMESTAMP
+'''
+
+# One connection is kept open for the life of the rotator rather than
+# reopened every rotation, so its page and statement caches survive
+_db = None
 
 def get_db():
     """Connect to database"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _db
+    if _db is None:
+        # Autocommit mode: each rotation takes the write lock explicitly
+        # with BEGIN IMMEDIATE. Rows stay plain tuples; the only read is
+        # the current (artist, title), compared whole against _TRACK_KEYS.
+        _db = sqlite3.connect(DATABASE, isolation_level=None)
+        # WAL is persistent in the file (flask_app.init_db sets it too);
+        # it keeps the Flask app's reads running while a rotation commits.
+        # busy_timeout rides out the app's own writes.
+        _db.execute('PRAGMA journal_mode = WAL')
+        _db.execute('PRAGMA busy_timeout = 5000')
+        _db.execute('PRAGMA synchronous = NORMAL')
+        _db.execute('PRAGMA temp_store = MEMORY')
+    return _db
+
+def close_db():
+    """Close the shared connection"""
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
 
 def rotate_track():
     """Rotate to a new random track"""
     db = get_db()
-    cursor = db.cursor()
 
-    # Get current track
-    current = cursor.execute('SELECT artist, title FROM tracks WHERE is_current = 1').fetchone()
+    # Get current track as an (artist, title) tuple, or None
+    current = db.execute(SQL_GET_CURRENT).fetchone()
 
     # Choose a random new track
-    new_track = random.choice(TRACK_POOL)
-    artist, title, album, year = new_track
-
-    # Don't repeat the same track
-    if current and current['artist'] == artist and current['title'] == title:
-        # Try another one
-        other_tracks = [t for t in TRACK_POOL if not (t[0] == artist and t[1] == title)]
-        if other_tracks:
-            new_track = random.choice(other_tracks)
-            artist, title, album, year = new_track
-
-    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]")
-    print(f"🎵 Now Playing: {artist} - {title}")
-
-    # Mark all tracks as not current
-    cursor.execute('UPDATE tracks SET is_current = 0')
-
-    # Check if track exists
-    existing = cursor.execute('''
-        SELECT id FROM tracks
-        WHERE artist = ? AND title = ?
-    ''', (artist, title)).fetchone()
-
-    if existing:
-        # Update existing to current
-        cursor.execute('''
-            UPDATE tracks
-            SET is_current = 1, played_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (existing['id'],))
-    else:
-        # Insert new track
-        cursor.execute('''
-            INSERT INTO tracks (artist, title, album, year, is_current, album_art_url)
-            VALUES (?, ?, ?, ?, 1, ?)
-        ''', (artist, title, album, year, 'https://via.placeholder.com/300x300/231F20/D8F2D5?text=Live'))
-
-    db.commit()
-    db.close()
-
-    print(f"✓ Database updated")
+    i = random.randrange(len(TRACK_POOL))
+
+    # Don't repeat the same track: redraw until it differs, which takes one
+    # draw in most rotations and never builds a filtered copy of the pool
+    if current and len(TRACK_POOL) > 1:
+        while _TRACK_KEYS[i] == current:
+            i = random.randrange(len(TRACK_POOL))
+    artist, title, album, year = TRACK_POOL[i]
+
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(SQL_CLEAR_CURRENT)
+        db.execute(SQL_UPSERT_CURRENT, (artist, title, album, year, ALBUM_ART_URL))
+
+    # One write per rotation, once the track is actually committed
+    print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}]\n"
+          f"🎵 Now Playing: {artist} - {title}\n"
+          f"✓ Database updated")
+
+def try_rotate_track():
+    """Rotate, reporting a database error instead of raising it
+
+    A locked database or a missing (artist, title) index fails only this
+    rotation; the next tick tries again.
+    """
+    try:
+        rotate_track()
+    except sqlite3.Error as e:
+        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}]\n"
+              f"✗ Rotation failed: {e}")
+
+def run():
+    """Rotate now, then every ROTATION_INTERVAL seconds, forever
+
+    Also the entry point flask_app uses to run the rotator on a background
+    thread in development.
+    """
+    # Rotations run on a fixed monotonic schedule, so the time a rotation
+    # takes does not push every later one back
+    next_rotation = time.monotonic() + ROTATION_INTERVAL
+
+    # Initial rotation
+    try_rotate_track()
+
+    while True:
+        time.sleep(max(0, next_rotation - time.monotonic()))
+        try_rotate_track()
+
+        next_rotation += ROTATION_INTERVAL
+        behind = time.monotonic() - next_rotation
+        if behind >= 0:
+            # Stalled past whole intervals: skip them rather than
+            # rotating several times back to back
+            next_rotation += (behind // ROTATION_INTERVAL + 1) * ROTATION_INTERVAL
 
 def main():
     """Main loop"""
@@ -98,15 +153,12 @@ def main():
     print("Press Ctrl+C to stop")
     print("=" * 60)
 
-    # Initial rotation
-    rotate_track()
-
     try:
-        while True:
-            time.sleep(ROTATION_INTERVAL)
-            rotate_track()
+        run()
     except KeyboardInterrupt:
         print("\n\n👋 Track rotator stopped")
+    finally:
+        close_db()
 
 if __name__ == '__main__':
     main()